@@ -41,6 +41,13 @@ class BinAction:
     def get_plan(self, context: InstallContext) -> Iterator[FileAction]:
         raise NotImplementedError()
 
+    def bundle_ids(self) -> Iterator[str]:
+        """
+        Yields the bundle ids that get_plan() will look up, so that they can
+        all be found at once beforehand.
+        """
+        yield from ()
+
 
 class PythonScript(BinAction):
     def __init__(self, script, args=None, bin_name: Optional[str] = None):
@@ -137,6 +144,9 @@ class IfBundle(BinAction):
     def __repr__(self):
         return "{0.__class__.__name__}({0.bundle_id!r}, {0.action!r})".format(self)
 
+    def bundle_ids(self) -> Iterator[str]:
+        yield self.bundle_id
+
     def get_plan(self, context: InstallContext) -> Iterator[FileAction]:
         try:
             app_dir_str = find_app_by_bundle_id(self.bundle_id)
@@ -1,16 +1,44 @@
 import os
+import stat
+import tempfile
 from pathlib import Path
 
 
+def _replace_with(path: Path, create):
+    """
+    Replaces whatever is at `path` with the file that `create` makes at the
+    temporary path it's given, so that `path` is never missing partway.
+    """
+    temp_dir = tempfile.mkdtemp(dir=path.parent, prefix=".")
+    try:
+        temp_path = Path(temp_dir) / path.name
+        create(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        # Empty unless create or replace failed
+        for leftover in Path(temp_dir).iterdir():
+            leftover.unlink()
+        os.rmdir(temp_dir)
+
+
 class FileAction:
     def get_path(self) -> Path:
         raise NotImplementedError()
 
+    def is_current(self) -> bool:
+        """
+        Returns True if the path already has exactly what execute() would
+        put there.
+        """
+        raise NotImplementedError()
+
     def execute(self):
         raise NotImplementedError()
 
 
 class ScriptFile(FileAction):
+    MODE = 0o755
+
     def __init__(self, path: Path, source: str):
         self.path = path
         self.source = source
@@ -18,10 +46,22 @@ class ScriptFile(FileAction):
     def get_path(self) -> Path:
         return self.path
 
+    def is_current(self) -> bool:
+        try:
+            st = os.lstat(self.path)
+            if not stat.S_ISREG(st.st_mode) or stat.S_IMODE(st.st_mode) != self.MODE:
+                return False
+            return self.path.read_bytes() == self.source.encode("utf-8")
+        except OSError:
+            return False
+
     def execute(self):
-        with open(self.path, "w", encoding="utf-8") as writer:
+        _replace_with(self.path, self._write)
+
+    def _write(self, path: Path):
+        with open(path, "w", encoding="utf-8") as writer:
             writer.write(self.source)
-        self.path.chmod(0o755)
+        path.chmod(self.MODE)
 
 
 class Symlink(FileAction):
@@ -32,5 +72,14 @@ class Symlink(FileAction):
     def get_path(self) -> Path:
         return self.link_path
 
+    def is_current(self) -> bool:
+        try:
+            return os.readlink(self.link_path) == self.link_content
+        except OSError:
+            return False
+
     def execute(self):
-        os.symlink(self.link_content, self.link_path)
+        _replace_with(self.link_path, self._link)
+
+    def _link(self, path: Path):
+        os.symlink(self.link_content, path)
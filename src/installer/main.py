@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import os.path
 import re
 import shlex
@@ -11,12 +12,13 @@ from pathlib import Path
 from typing import Optional
 
 from config.manifest import manifest
-from utils.macos.appbundle import BundleError
+from utils.macos.appbundle import BundleError, prefetch_bundle_ids
 from utils.shell import cli_filename
 from utils.text import u8open
 
 from .binactions import BinAction, InstallContext
 from .console import CORN, OUTPUT_DIVIDER, POPCORN, STEP_DIVIDER
+from .fsactions import FileAction
 from .rc import chatty_file_edit, determine_shell_rc_path
 from .receipts import ReceiptLog
 
@@ -33,8 +35,10 @@ def get_arg_parser():
         action="store_true",
         help="""
             Create a new virtual environment for shelpers even if one
-            already exists.  The default is to only create one if it doesn't
-            exist.
+            already exists, and reinstall its dependencies.  The default is
+            to only create one if it doesn't exist, and to only install
+            dependencies if requirements.txt has changed since they were
+            last installed.
         """,
     )
 
@@ -57,6 +61,26 @@ def get_arg_parser():
         """,
     )
 
+    wheelhouse = p.add_mutually_exclusive_group()
+    wheelhouse.add_argument(
+        "--build-wheelhouse",
+        metavar="DIR",
+        help="""
+            Download or build wheels of all dependencies into DIR, then
+            install from there. DIR can then be given to --wheelhouse on
+            machines without network access, as long as they have the same
+            platform and Python version.
+        """,
+    )
+    wheelhouse.add_argument(
+        "--wheelhouse",
+        metavar="DIR",
+        help="""
+            Install dependencies only from the wheels in DIR, made by
+            --build-wheelhouse, without contacting a package index.
+        """,
+    )
+
     return p
 
 
@@ -101,6 +125,8 @@ class InstallJob:
         force_venv: bool,
         allow_edit_shell_rc: Optional[bool],
         shell_rc_path: Optional[Path],
+        wheelhouse_path: Optional[Path] = None,
+        build_wheelhouse: bool = False,
     ):
         self.root = root
         self.python_exec = python_exec
@@ -108,6 +134,8 @@ class InstallJob:
         self.force_venv = force_venv
         self.allow_edit_shell_rc = allow_edit_shell_rc
         self.shell_rc_path = shell_rc_path
+        self.wheelhouse_path = wheelhouse_path
+        self.build_wheelhouse = build_wheelhouse
 
         self._receipts = ReceiptLog(self.root / "bin.log")
 
@@ -127,18 +155,52 @@ class InstallJob:
     def venv_python_bin(self):
         return self.venv_path / "bin" / "python"
 
+    @property
+    def requirements_path(self):
+        return self.root / "requirements.txt"
+
+    @property
+    def requirements_stamp_path(self):
+        # Inside the venv, so that recreating it removes the stamp as well
+        return self.venv_path / "shelpers-requirements.stamp"
+
+    def requirements_stamp(self) -> str:
+        """
+        Returns a digest of everything that determines what gets installed
+        into the venv: the requirements, and the interpreter it runs on.
+        """
+        digest = hashlib.sha256()
+        digest.update(self.requirements_path.read_bytes())
+        digest.update(b"\0")
+        digest.update(sys.version.encode())
+        digest.update(b"\0")
+        digest.update(os.fsencode(os.path.realpath(self.venv_python_bin)))
+        return digest.hexdigest()
+
+    def requirements_are_current(self) -> bool:
+        try:
+            stamp = self.requirements_stamp_path.read_text(encoding="ascii").strip()
+        except (OSError, UnicodeDecodeError):
+            return False
+        return stamp == self.requirements_stamp()
+
     def run(self):
         self.create_venv()
-        self.install_requirements()
-        self.clear_bins()
-        self.generate_bins()
+        if self.build_wheelhouse:
+            self.fill_wheelhouse()
+        requirements_installed = self.install_requirements()
+        self.update_bins()
         self.edit_shell_rc()
 
         print(STEP_DIVIDER)
         print(f"{CORN} Complete!")
         print("Remember to restart your shell to see PATH updates.")
 
-        old_pipenv_venv_path = search_for_old_pipenv(self.root)
+        # Asking pipenv is slow, so this is only checked when something
+        # has changed
+        old_pipenv_venv_path = (
+            search_for_old_pipenv(self.root) if requirements_installed else None
+        )
         if old_pipenv_venv_path is not None:
             print(f"\n{POPCORN} An old pipenv environment was found for this project:")
             print(f"     {old_pipenv_venv_path}")
@@ -176,21 +238,58 @@ class InstallJob:
             check=True,
         )
 
-    def install_requirements(self):
-        print(STEP_DIVIDER)
-        print("Installing dependencies")
-        print(OUTPUT_DIVIDER)
-
-        pip = [
+    @property
+    def pip_command(self) -> list:
+        return [
             cli_filename(self.venv_python_bin),
             "-m",
             "pip",
         ]
 
+    def fill_wheelhouse(self):
+        assert self.wheelhouse_path is not None
+        print(STEP_DIVIDER)
+        print(f"Building wheelhouse in {str(self.wheelhouse_path)!r}")
+        print(OUTPUT_DIVIDER)
+
+        # pip is included, as it's upgraded before anything else is installed
         subprocess.run(
             [
-                *pip,
-                "install",
+                *self.pip_command,
+                "wheel",
+                "--wheel-dir",
+                cli_filename(self.wheelhouse_path),
+                "pip",
+                "-r",
+                cli_filename(self.requirements_path),
+            ],
+            check=True,
+        )
+
+    def install_requirements(self) -> bool:
+        """
+        Installs dependencies into the venv, unless they are already
+        installed from the current requirements.txt. Returns whether they
+        were installed.
+        """
+        print(STEP_DIVIDER)
+
+        if not self.force_venv and self.requirements_are_current():
+            print("Dependencies are up to date")
+            return False
+
+        print("Installing dependencies")
+        print(OUTPUT_DIVIDER)
+
+        pip_install = [*self.pip_command, "install"]
+        if self.wheelhouse_path is not None:
+            pip_install.extend(
+                ("--no-index", "--find-links", cli_filename(self.wheelhouse_path))
+            )
+
+        subprocess.run(
+            [
+                *pip_install,
                 "--upgrade",
                 "pip",
             ],
@@ -199,55 +298,37 @@ class InstallJob:
 
         subprocess.run(
             [
-                *pip,
-                "install",
+                *pip_install,
                 "-r",
-                cli_filename(self.root / "requirements.txt"),
+                cli_filename(self.requirements_path),
             ],
             check=True,
         )
 
-    def clear_bins(self):
-        print(STEP_DIVIDER)
-        print("Clearing bin directory")
-
-        receipts = list(self._receipts.load())
-        for name in receipts:
-            (self.bin_path / name).unlink(missing_ok=True)
-        self._receipts.clear()
-
-        try:
-            leftovers = [
-                entry
-                for entry in self.bin_path.iterdir()
-                if not entry.name.startswith(".")
-            ]
-            if leftovers:
-                print(OUTPUT_DIVIDER)
-                print("Not clearing:")
-                for entry in leftovers:
-                    print(f"  {entry.name!r}")
-        except FileNotFoundError:
-            pass
-
-    def generate_bins(self):
-        print(STEP_DIVIDER)
-        print("Populating bin directory")
-        print(OUTPUT_DIVIDER)
+        self.requirements_stamp_path.write_text(
+            self.requirements_stamp() + "\n", encoding="ascii"
+        )
+        return True
 
-        self.bin_path.mkdir(parents=True, exist_ok=True)
+    def plan_bins(self) -> dict[str, FileAction]:
         context = InstallContext(
             root=self.root,
             bin=self.bin_path,
             venv_python_bin=self.venv_python_bin,
         )
-        plan = {}  # Ordered since 3.7
+        plan: dict[str, FileAction] = {}  # Ordered since 3.7
+
+        # One Spotlight query for the whole manifest, rather than one each
+        prefetch_bundle_ids(
+            bundle_id
+            for manifest_item in self.manifest
+            for bundle_id in manifest_item.bundle_ids()
+        )
 
         for manifest_item in self.manifest:
             try:
                 for p in manifest_item.get_plan(context):
-                    path = p.get_path()
-                    k = str(path)
+                    k = os.fspath(p.get_path().relative_to(self.bin_path))
                     if k in plan:
                         raise ValueError(
                             f"Multiple entries in manifest attempting to write to the same file {k!r}"
@@ -258,11 +339,51 @@ class InstallJob:
                 traceback.print_exc()
                 continue
 
-        for command in plan.values():
-            receipt_path = command.get_path().relative_to(self.bin_path)
-            self._receipts.append(receipt_path)
-            print(f"  {str(receipt_path)!r}")
+        return plan
+
+    def update_bins(self):
+        """
+        Brings the bin directory in line with the manifest, only touching
+        files that are new, changed or no longer wanted. Rewriting every
+        file would make shells forget their hashed command locations, and
+        is slow on network home directories.
+        """
+        print(STEP_DIVIDER)
+        print("Updating bin directory")
+
+        plan = self.plan_bins()
+        old_receipts = list(self._receipts.load())
+        removed = [name for name in old_receipts if name not in plan]
+        changed = {
+            name: command for name, command in plan.items() if not command.is_current()
+        }
+
+        # Everything this might leave behind is recorded before it's
+        # touched, in case it's interrupted
+        self._receipts.save({**dict.fromkeys(old_receipts), **plan}.keys())
+        self.bin_path.mkdir(parents=True, exist_ok=True)
+
+        if removed or changed:
+            print(OUTPUT_DIVIDER)
+        for name in removed:
+            print(f"  Removing {name!r}")
+            (self.bin_path / name).unlink(missing_ok=True)
+        for name, command in changed.items():
+            print(f"  Writing {name!r}")
             command.execute()
+        self._receipts.save(plan.keys())
+        print(f"{len(plan) - len(changed)} files unchanged")
+
+        leftovers = [
+            entry.name
+            for entry in self.bin_path.iterdir()
+            if not entry.name.startswith(".") and entry.name not in plan
+        ]
+        if leftovers:
+            print(OUTPUT_DIVIDER)
+            print("Not managed by shelpers:")
+            for name in leftovers:
+                print(f"  {name!r}")
 
     def edit_shell_rc(self):
         print(STEP_DIVIDER)
@@ -343,6 +464,7 @@ def main():
     args = get_arg_parser().parse_args()
 
     rcfile = Path(args.rcfile) if args.rcfile else None
+    wheelhouse = args.build_wheelhouse or args.wheelhouse
     job = InstallJob(
         repo_root,
         python_path,
@@ -350,6 +472,8 @@ def main():
         args.force_venv,
         args.editrc,
         rcfile,
+        Path(wheelhouse).absolute() if wheelhouse else None,
+        args.build_wheelhouse is not None,
     )
 
     return job.run()
@@ -1,5 +1,6 @@
 import ast
 import os
+from collections.abc import Iterable
 from pathlib import Path
 
 from utils.text import u8open
@@ -9,9 +10,6 @@ class ReceiptLog:
     def __init__(self, path):
         self.path = Path(path)
 
-    def clear(self):
-        self.path.unlink(missing_ok=True)
-
     def load(self):
         try:
             with u8open(self.path, "r") as reader:
@@ -22,6 +20,16 @@ class ReceiptLog:
         except FileNotFoundError:
             pass
 
-    def append(self, name):
-        with u8open(self.path, "a") as writer:
-            print(repr(os.fspath(name)), file=writer)
+    def save(self, names: Iterable):
+        """
+        Replaces the log with `names`.
+        """
+        temp_path = self.path.with_name(f".{self.path.name}.tmp")
+        try:
+            with u8open(temp_path, "w") as writer:
+                for name in names:
+                    print(repr(os.fspath(name)), file=writer)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
@@ -1,99 +1,757 @@
 import argparse
+import io
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
 
+from utils.argtypes import positive_int
 from utils.errors import ErrorReporter
+from utils.imageopt import (
+    ImageFormat,
+    is_complete_image,
+    pillow_encoders,
+    sniff_file_format,
+    sniff_format,
+    SNIFF_SIZE,
+    UnsupportedImage,
+)
+from utils.optdb import (
+    OptimizedDB,
+    OUTCOME_INCOMPRESSIBLE,
+    OUTCOME_OPTIMIZED,
+    record_file,
+)
 from utils.shell import cli_filename
+from utils.ziputil import copy_member_raw, is_encrypted, strip_zip64_extra
 
 
 def get_arg_parser():
     p = argparse.ArgumentParser(
         description="""\
-            Use jpegtran to optimize JPEG image files
-            in-place."""
+            Losslessly optimize image files in-place. JPEG files are
+            optimized with jpegtran. PNG and GIF files are optimized with
+            oxipng or gifsicle if installed, otherwise they are recompressed
+            with Pillow."""
     )
 
     p.add_argument(
-        "paths", nargs="+", help="The jpeg files to optimize", metavar="PATH"
+        "paths", nargs="+", help="The image files to optimize", metavar="PATH"
+    )
+
+    p.add_argument(
+        "--jobs",
+        "-j",
+        type=positive_int,
+        default=os.cpu_count() or 1,
+        help="""\
+            The number of files to optimize concurrently. The default is the
+            number of CPUs, %(default)s.""",
+        metavar="N",
+    )
+
+    p.add_argument(
+        "--strategy",
+        "-s",
+        action="append",
+        choices=STRATEGIES.keys(),
+        dest="strategies",
+        help="""\
+            A jpegtran encoding to try. Specify more than once to try several
+            concurrently and keep the smallest, reporting the savings of
+            each. 'arithmetic' is often the smallest but is not supported by
+            many decoders. The default is to only use 'optimize'.""",
+    )
+
+    p.add_argument(
+        "--archives",
+        "-z",
+        action="store_true",
+        help="""\
+            Also optimize JPEG files inside zip archives, such as .cbz comic
+            archives. Each archive is rewritten in a single pass, copying
+            other members without recompressing them. When recursing, only
+            files named .zip or .cbz are treated as archives.""",
+    )
+
+    p.add_argument(
+        "--recurse",
+        "-r",
+        action="store_true",
+        help="""\
+            Recursively search directories for JPEG, PNG and GIF files and
+            optimize them.
+            Files are identified by their content, not their name.""",
+    )
+
+    p.add_argument(
+        "--db",
+        help="""\
+            A database file recording files that have already been optimized,
+            or found not to get any smaller. Files that haven't changed since
+            they were recorded, with the same strategies or more, are
+            skipped. It will be created if it doesn't exist.""",
+        metavar="DB_PATH",
     )
 
     return p
 
 
 EXIT_CODE_UNEXPECTED = 65
+# Returned for files left alone because they can't be handled here. Not a
+# real exit code: it counts as success, but the file isn't recorded as done.
+EXIT_CODE_SKIPPED = -1
+
+IN_MEMORY_MAX_BYTES = 16 * 1024 * 1024
+
+ZIP_SIGNATURE = b"PK\x03\x04"
+ARCHIVE_SUFFIXES = (".cbz", ".zip")
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+# Lossless jpegtran options to try, in addition to `-copy icc`. Arithmetic
+# coding is usually the smallest, but isn't supported by many decoders.
+STRATEGIES = {
+    "optimize": ("-optimize",),
+    "progressive": ("-progressive",),
+    "arithmetic": ("-arithmetic",),
+}
+DEFAULT_STRATEGIES = ("optimize",)
+
+# Used in preference to Pillow if they are installed. Output goes to stdout.
+EXTERNAL_OPTIMIZERS = {
+    ImageFormat.PNG: ("oxipng", "--opt", "2", "--stdout"),
+    ImageFormat.GIF: ("gifsicle", "--optimize=3"),
+}
 
 reporter = ErrorReporter.from_argv()
 
 
-def jpegopt_with_tempfile(path, temp_file):
-    try:
-        input_size = os.path.getsize(path)
-    except OSError as env_err:
-        reporter.print_error("Could not get file size.", env_err, path)
-        input_size = None
+class PathLocks:
+    """
+    Hands out one lock per real path, so that the same file named twice on
+    the command line is never rewritten by two jobs at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = defaultdict(threading.Lock)
+
+    def get(self, path):
+        with self._lock:
+            return self._locks[os.path.realpath(path)]
+
+
+@dataclass
+class Candidate:
+    """
+    The output of one optimizer strategy, held either in memory as `data`,
+    or in the file at `temp_path`.
+    """
+
+    tool: str
+    strategy: str
+    exit_code: int
+    stderr: str
+    size: int
+    valid: bool
+    data: bytes = b""
+    temp_path: Optional[str] = None
+
+
+def is_complete_jpeg(head, tail):
+    return head.startswith(JPEG_SOI) and tail.endswith(JPEG_EOI)
+
+
+def run_jpegtran(path, stdout, strategy, input=None):
+    """
+    Runs jpegtran on the file at `path`, or if `path` is None, on the bytes
+    given as `input`.
+    """
+    args = ["jpegtran", "-copy", "icc", *STRATEGIES[strategy]]
+    if path is not None:
+        args.append(cli_filename(path))
+    return subprocess.run(
+        args,
+        input=input,
+        stdout=stdout,
+        stderr=subprocess.PIPE,
+    )
+
+
+def in_memory_candidate(path, strategy, input=None):
+    run_result = run_jpegtran(
+        path if input is None else None, subprocess.PIPE, strategy, input
+    )
+    data = run_result.stdout
+    return Candidate(
+        tool="jpegtran",
+        strategy=strategy,
+        exit_code=run_result.returncode,
+        stderr=run_result.stderr.decode(errors="replace"),
+        size=len(data),
+        valid=is_complete_jpeg(data, data),
+        data=data,
+    )
 
+
+def tempfile_candidate(path, strategy, temp_file, temp_path):
+    with temp_file:
+        run_result = run_jpegtran(path, temp_file, strategy)
+        size = temp_file.tell()
+        temp_file.seek(0)
+        head = temp_file.read(len(JPEG_SOI))
+        temp_file.seek(max(0, size - len(JPEG_EOI)))
+        tail = temp_file.read()
+
+    return Candidate(
+        tool="jpegtran",
+        strategy=strategy,
+        exit_code=run_result.returncode,
+        stderr=run_result.stderr.decode(errors="replace"),
+        size=size,
+        valid=is_complete_jpeg(head, tail),
+        temp_path=temp_path,
+    )
+
+
+def external_candidate(path, command, image_format):
     run_result = subprocess.run(
-        ("jpegtran", "-copy", "icc", "-optimize", cli_filename(path)),
-        stdout=temp_file,
+        (*command, cli_filename(path)),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
     )
-    exit_code = run_result.returncode
+    data = run_result.stdout
+    return Candidate(
+        tool=command[0],
+        strategy=command[0],
+        exit_code=run_result.returncode,
+        stderr=run_result.stderr.decode(errors="replace"),
+        size=len(data),
+        valid=is_complete_image(data, image_format),
+        data=data,
+    )
+
+
+def pillow_candidate(path, encode, image_format):
+    try:
+        encoding = encode()
+    except Exception as encode_error:
+        return Candidate(
+            tool="Pillow",
+            strategy=getattr(encode, "__name__", "Pillow"),
+            exit_code=1,
+            stderr=reporter.format_error("Pillow failed.", encode_error, path) + "\n",
+            size=0,
+            valid=False,
+        )
+
+    return Candidate(
+        tool="Pillow",
+        strategy=encoding.name,
+        exit_code=0,
+        stderr="",
+        size=len(encoding.data),
+        valid=encoding.valid and is_complete_image(encoding.data, image_format),
+        data=encoding.data,
+    )
+
+
+def run_concurrently(func, items):
+    if len(items) == 1:
+        return [func(items[0])]
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        return list(executor.map(func, items))
+
+
+def format_savings(candidate, input_size):
+    if candidate.exit_code != 0:
+        return f"{candidate.strategy} failed"
+    if not candidate.valid:
+        return f"{candidate.strategy} invalid"
+    if not input_size:
+        return f"{candidate.strategy} {candidate.size} bytes"
+    change = (candidate.size - input_size) / input_size
+    return f"{candidate.strategy} {change:+.1%}"
+
+
+def choose_candidate(path, candidates, input_size, report_savings, log):
+    """
+    Writes out the stderr of each candidate and picks the smallest valid
+    one, reporting the savings of each if `report_savings` is true. Returns
+    the chosen Candidate, or if none are valid, the first.
+    """
+    for candidate in candidates:
+        log.write(candidate.stderr)
+
+    if report_savings:
+        savings = ", ".join(format_savings(c, input_size) for c in candidates)
+        reporter.print_error(
+            f"Strategy savings: {savings}.", subject_file=path, file=log
+        )
+
+    valid = [c for c in candidates if c.exit_code == 0 and c.valid]
+    if not valid:
+        return candidates[0]
+    return min(valid, key=lambda c: c.size)
 
-    replace = True
+
+def check_output(path, candidate, input_size, log):
+    """
+    Decides whether an optimizer's output should replace the original file.
+    Returns a tuple of (exit_code, replace).
+    """
+    exit_code = candidate.exit_code
     if exit_code != 0:
-        reporter.print_error(f"jpegtran failed {exit_code=}.", subject_file=path)
-        replace = False
+        reporter.print_error(
+            f"{candidate.tool} failed {exit_code=}.", subject_file=path, file=log
+        )
+        return exit_code, False
 
-    elif input_size is not None:
-        output_size = temp_file.tell()
-        if output_size == 0:
+    if input_size is not None:
+        if candidate.size == 0:
+            reporter.print_error(
+                "New file size is 0. Not replacing.", subject_file=path, file=log
+            )
+            return EXIT_CODE_UNEXPECTED, False
+        if candidate.size >= input_size:
             reporter.print_error(
-                "New file size is 0. Not replacing.", subject_file=path
+                "File increased in size. Not replacing.", subject_file=path, file=log
             )
-            exit_code = EXIT_CODE_UNEXPECTED
-            replace = False
-        elif output_size >= input_size:
+            return exit_code, False
+
+    if not candidate.valid:
+        reporter.print_error(
+            "New file is not a complete image. Not replacing.",
+            subject_file=path,
+            file=log,
+        )
+        return EXIT_CODE_UNEXPECTED, False
+
+    return exit_code, True
+
+
+def sibling_tempfile(target):
+    """
+    Creates a temp file in the same directory as `target`, so that it can
+    later be renamed over it. Returns a tuple of (file_object, temp_path).
+    """
+    directory, name = os.path.split(target)
+    temp_fd, temp_path = tempfile.mkstemp(
+        prefix=f".{name}.", suffix=".tmp", dir=directory or os.curdir
+    )
+    return os.fdopen(temp_fd, "w+b"), temp_path
+
+
+def replace_with_tempfile(target, temp_path):
+    """
+    Atomically replaces `target` with `temp_path`, carrying over the
+    original's ownership, permissions, timestamps and extended attributes.
+    """
+    target_stat = os.stat(target)
+    try:
+        os.chown(temp_path, target_stat.st_uid, target_stat.st_gid)
+    except PermissionError:
+        pass
+    shutil.copystat(target, temp_path)
+    os.replace(temp_path, target)
+
+
+def remove_tempfile(temp_path, log):
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        # Already renamed over the target
+        pass
+    except OSError as env_err:
+        reporter.print_error(
+            "Could not delete temp file.", env_err, temp_path, file=log
+        )
+
+
+def replace_from_memory(path, target, input_size, candidates, report_savings, log):
+    candidate = choose_candidate(path, candidates, input_size, report_savings, log)
+    exit_code, replace = check_output(path, candidate, input_size, log)
+
+    if replace:
+        temp_path = None
+        try:
+            temp_file, temp_path = sibling_tempfile(target)
+            with temp_file:
+                temp_file.write(candidate.data)
+            replace_with_tempfile(target, temp_path)
+        except OSError as env_err:
+            reporter.print_error("Could not replace file.", env_err, path, file=log)
+            exit_code = 1
+        finally:
+            if temp_path is not None:
+                remove_tempfile(temp_path, log)
+
+    return exit_code
+
+
+def jpegopt_in_memory(path, target, input_size, strategies, log):
+    candidates = run_concurrently(
+        lambda strategy: in_memory_candidate(path, strategy), strategies
+    )
+    return replace_from_memory(
+        path, target, input_size, candidates, len(strategies) > 1, log
+    )
+
+
+def lossless_in_memory(path, target, input_size, image_format, report_savings, log):
+    """
+    Optimizes a PNG or GIF file with an external optimizer if one is
+    installed, otherwise by trying several lossless Pillow encodings
+    concurrently.
+    """
+    command = EXTERNAL_OPTIMIZERS[image_format]
+    if shutil.which(command[0]) is not None:
+        candidates = [external_candidate(path, command, image_format)]
+    else:
+        try:
+            with open(path, "rb") as reader:
+                encoders = pillow_encoders(reader.read(), image_format)
+        except UnsupportedImage as unsupported:
             reporter.print_error(
-                "File increased in size. Not replacing.", subject_file=path
+                f"Can't optimize {unsupported} without {command[0]}. Skipping.",
+                subject_file=path,
+                file=log,
             )
-            replace = False
+            return EXIT_CODE_SKIPPED
+        except Exception as read_error:
+            reporter.print_error("Could not read image.", read_error, path, file=log)
+            return 1
+
+        candidates = run_concurrently(
+            lambda encode: pillow_candidate(path, encode, image_format), encoders
+        )
+
+    return replace_from_memory(
+        path, target, input_size, candidates, report_savings, log
+    )
+
+
+def jpegopt_with_tempfiles(path, target, temp_files, input_size, strategies, log):
+    """
+    Runs each strategy into its own (file_object, temp_path) from
+    `temp_files`, and renames the best over the target. The caller is
+    responsible for removing the temp files that remain.
+    """
+    candidates = run_concurrently(
+        lambda item: tempfile_candidate(path, item[0], *item[1]),
+        list(zip(strategies, temp_files)),
+    )
+    candidate = choose_candidate(path, candidates, input_size, len(strategies) > 1, log)
+    exit_code, replace = check_output(path, candidate, input_size, log)
 
     if replace:
         try:
-            temp_file.seek(0)
-            with open(path, "wb") as writer:
-                shutil.copyfileobj(temp_file, writer)
+            replace_with_tempfile(target, candidate.temp_path)
         except OSError as env_err:
-            reporter.print_error("Could not replace file.", env_err, path)
+            reporter.print_error("Could not replace file.", env_err, path, file=log)
             exit_code = 1
 
     return exit_code
 
 
-def jpegopt(path):
-    temp_fd, temp_path = tempfile.mkstemp(suffix=".jpg")
-    temp_file = os.fdopen(temp_fd, "w+b")
+def optimize_zip_member(source, info, subject, strategies, log):
+    """
+    Runs jpegtran on a zip member if it is a JPEG. Returns a tuple of
+    (exit_code, data), where `data` is the optimized member, or None if it
+    isn't a JPEG or couldn't be made smaller.
+    """
+    if info.is_dir() or is_encrypted(info):
+        return 0, None
 
+    with source.open(info) as member:
+        head = member.read(SNIFF_SIZE)
+        if sniff_format(head) is not ImageFormat.JPEG:
+            return 0, None
+        data = head + member.read()
+
+    candidates = run_concurrently(
+        lambda strategy: in_memory_candidate(subject, strategy, data), strategies
+    )
+    candidate = choose_candidate(subject, candidates, len(data), False, log)
+    if candidate.exit_code != 0:
+        reporter.print_error(
+            f"{candidate.tool} failed exit_code={candidate.exit_code}.",
+            subject_file=subject,
+            file=log,
+        )
+        return candidate.exit_code, None
+
+    if candidate.valid and 0 < candidate.size < len(data):
+        return 0, candidate.data
+    return 0, None
+
+
+def write_optimized_zip(path, dest_file, strategies, log):
+    """
+    Writes a copy of the zip archive at `path` to `dest_file`, with its JPEG
+    members optimized. All other members are copied as raw compressed
+    data. Returns a tuple of (exit_code, optimized_count).
+    """
+    exit_code = 0
+    optimized_count = 0
+    with open(path, "rb") as source_fp, zipfile.ZipFile(source_fp) as source:
+        with zipfile.ZipFile(dest_file, "w") as dest:
+            dest.comment = source.comment
+            for info in source.infolist():
+                subject = f"{os.fspath(path)}:{info.filename}"
+                member_code, data = optimize_zip_member(
+                    source, info, subject, strategies, log
+                )
+                exit_code = max(exit_code, member_code)
+
+                if data is None:
+                    copy_member_raw(source_fp, info, dest)
+                else:
+                    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+                    new_info.compress_type = info.compress_type
+                    new_info.comment = info.comment
+                    new_info.extra = strip_zip64_extra(info.extra)
+                    new_info.create_system = info.create_system
+                    new_info.external_attr = info.external_attr
+                    dest.writestr(new_info, data)
+                    optimized_count += 1
+
+    return exit_code, optimized_count
+
+
+def zipopt(path, target, input_size, strategies, log):
     try:
-        return jpegopt_with_tempfile(path, temp_file)
+        temp_file, temp_path = sibling_tempfile(target)
+    except OSError as env_err:
+        reporter.print_error("Could not create temp file.", env_err, path, file=log)
+        return 1
+
+    try:
+        with temp_file:
+            try:
+                exit_code, optimized_count = write_optimized_zip(
+                    path, temp_file, strategies, log
+                )
+            except (OSError, zipfile.BadZipFile) as zip_error:
+                reporter.print_error(
+                    "Could not read archive.", zip_error, path, file=log
+                )
+                return 1
+            size = temp_file.tell()
+
+        if optimized_count == 0:
+            return exit_code
+
+        candidate = Candidate(
+            tool="zipfile",
+            strategy="zipfile",
+            exit_code=0,
+            stderr="",
+            size=size,
+            valid=True,
+            temp_path=temp_path,
+        )
+        check_code, replace = check_output(path, candidate, input_size, log)
+        exit_code = max(exit_code, check_code)
+
+        if replace:
+            try:
+                replace_with_tempfile(target, temp_path)
+            except OSError as env_err:
+                reporter.print_error("Could not replace file.", env_err, path, file=log)
+                exit_code = 1
+
+        return exit_code
     finally:
-        temp_file.close()
+        remove_tempfile(temp_path, log)
+
+
+def is_zip_file(path):
+    try:
+        with open(path, "rb") as reader:
+            return reader.read(len(ZIP_SIGNATURE)) == ZIP_SIGNATURE
+    except OSError:
+        return False
+
+
+def jpegopt(path, log=sys.stderr, strategies=DEFAULT_STRATEGIES, archives=False):
+    try:
+        input_size = os.path.getsize(path)
+    except OSError as env_err:
+        reporter.print_error("Could not get file size.", env_err, path, file=log)
+        input_size = None
+
+    # Replace the file a symlink points to, not the symlink itself
+    target = os.path.realpath(path)
+
+    try:
+        image_format = sniff_file_format(path)
+    except OSError:
+        # Leave it to jpegtran to report
+        image_format = None
+
+    if archives and image_format is None and is_zip_file(path):
+        return zipopt(path, target, input_size, strategies, log)
+
+    if image_format in EXTERNAL_OPTIMIZERS:
+        return lossless_in_memory(
+            path, target, input_size, image_format, len(strategies) > 1, log
+        )
+
+    # Small files are captured straight from jpegtran's stdout, so only the
+    # final replacement touches the disk
+    if input_size is not None and input_size <= IN_MEMORY_MAX_BYTES:
+        return jpegopt_in_memory(path, target, input_size, strategies, log)
+
+    temp_files = []
+    try:
         try:
-            os.remove(temp_path)
+            for _ in strategies:
+                temp_files.append(sibling_tempfile(target))
         except OSError as env_err:
-            reporter.print_error("Could not delete temp file.", env_err, temp_path)
+            reporter.print_error("Could not create temp file.", env_err, path, file=log)
+            return 1
+
+        return jpegopt_with_tempfiles(
+            path, target, temp_files, input_size, strategies, log
+        )
+    finally:
+        for temp_file, temp_path in temp_files:
+            temp_file.close()
+            remove_tempfile(temp_path, log)
+
+
+def is_image_file(path):
+    try:
+        return sniff_file_format(path) is not None
+    except OSError:
+        return False
+
+
+def recursive_image_iter(paths, archives=False):
+    """
+    Yields the image files in `paths`, descending into directories. Errors
+    reading a directory are yielded as OSErrors where they happen, so that
+    they can be reported in order with the files around them.
+    """
+    walk_errors = []
+    for path in paths:
+        if os.path.isdir(path):
+            for container, dirnames, filenames in os.walk(
+                path, onerror=walk_errors.append
+            ):
+                yield from walk_errors
+                walk_errors.clear()
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                for f in filenames:
+                    file_path = os.path.join(container, f)
+                    if is_image_file(file_path) or (
+                        archives
+                        and f.lower().endswith(ARCHIVE_SUFFIXES)
+                        and is_zip_file(file_path)
+                    ):
+                        yield file_path
+            yield from walk_errors
+            walk_errors.clear()
+        else:
+            yield path
+
+
+def jpegopt_buffered(path, path_locks, strategies, archives, track=False):
+    """
+    Runs jpegopt on one file, collecting everything it would print to stderr
+    so that the caller can emit it in input order. `path` can also be an
+    OSError from recursive_image_iter, which is just reported. Returns a
+    tuple of
+    (exit_code, log_text, record). If `track` is true and the file was
+    processed successfully, `record` is a FileRecord of its new state,
+    otherwise it is None.
+    """
+    log = io.StringIO()
+    if isinstance(path, OSError):
+        reporter.print_error("Error recursing.", path, path.filename, file=log)
+        return 0, log.getvalue(), None
+
+    record = None
+    try:
+        with path_locks.get(path):
+            input_size = os.path.getsize(path) if track else 0
+            exit_code = jpegopt(path, log, strategies, archives)
+            if exit_code == EXIT_CODE_SKIPPED:
+                exit_code = 0
+            elif track and exit_code == 0:
+                record = record_file(path, OUTCOME_INCOMPRESSIBLE, strategies)
+                if record.size < input_size:
+                    record = record._replace(outcome=OUTCOME_OPTIMIZED)
+    except Exception as jpegopt_error:
+        reporter.print_error("Unexpected error.", jpegopt_error, path, file=log)
+        exit_code = EXIT_CODE_UNEXPECTED
+    return exit_code, log.getvalue(), record
+
+
+def optimize_all(paths, jobs, strategies, archives, db=None):
+    path_locks = PathLocks()
+    track = db is not None
+    if db is not None:
+        # Skipping is decided here on the calling thread, as the generator is
+        # consumed by executor.map, which keeps all database access on one
+        # thread
+        paths = (
+            path
+            for path in paths
+            if isinstance(path, OSError) or not db.is_unchanged(path, strategies)
+        )
+
+    max_code = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # map() yields results in submission order, regardless of which job
+        # finishes first
+        for exit_code, log_text, record in executor.map(
+            lambda path: jpegopt_buffered(
+                path, path_locks, strategies, archives, track
+            ),
+            paths,
+        ):
+            sys.stderr.write(log_text)
+            max_code = max(max_code, exit_code)
+            if db is not None and record is not None:
+                db.put(record)
+    return max_code
 
 
 def main():
     config = get_arg_parser().parse_args()
+    paths = (
+        recursive_image_iter(config.paths, config.archives)
+        if config.recurse
+        else config.paths
+    )
+    strategies = (
+        tuple(dict.fromkeys(config.strategies))
+        if config.strategies
+        else DEFAULT_STRATEGIES
+    )
+
+    if config.db is None:
+        return optimize_all(paths, config.jobs, strategies, config.archives)
+
     try:
-        max_code = max(jpegopt(path) for path in config.paths)
-    except Exception as jpegopt_error:
-        reporter.print_error("Unexpected error.", jpegopt_error)
+        db = OptimizedDB(config.db)
+    except Exception as db_error:
+        reporter.print_error("Could not open database.", db_error, config.db)
         return EXIT_CODE_UNEXPECTED
-    return max_code
+
+    with db:
+        return optimize_all(paths, config.jobs, strategies, config.archives, db)
 
 
 if __name__ == "__main__":
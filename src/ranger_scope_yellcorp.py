@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import hashlib
 import os
+import re
 import shutil
 import sys
+import tempfile
 from dataclasses import dataclass
 from enum import IntEnum
 from pathlib import Path
@@ -19,6 +22,13 @@ from utils.image import (
 PREVIEW_MAX_SIZE = (1920, 1080)
 PREVIEW_JPEG_QUALITY = 70
 
+TEXT_PREVIEW_MAX_BYTES = 64 * 1024
+TEXT_PREVIEW_CACHE_DIR_NAME = "yellcorp-text"
+TEXT_PREVIEW_TAB_SIZE = 8
+
+# The color codes that highlighted output is made of
+_SGR_RE = re.compile(r"(\x1b\[[0-9;]*m)")
+
 EXIT_SHIFT = 64
 
 
@@ -74,6 +84,133 @@ def render_image_preview(source_path: Path, cache_path: Path) -> None:
     image.save(cache_path, format="JPEG", quality=PREVIEW_JPEG_QUALITY)
 
 
+def read_head(path: Path, max_bytes: int = TEXT_PREVIEW_MAX_BYTES) -> bytes:
+    with open(path, "rb") as reader:
+        return reader.read(max_bytes)
+
+
+def decode_text_head(head: bytes, truncated: bool) -> str | None:
+    """
+    Decodes the first chunk of a file as UTF-8, or returns None if it looks
+    binary. If the chunk was truncated, an incomplete multibyte sequence at
+    the very end is tolerated.
+    """
+    if b"\x00" in head:
+        return None
+    try:
+        return head.decode("utf-8")
+    except UnicodeDecodeError as decode_error:
+        # A cut-off sequence can be at most 3 bytes short of complete
+        if truncated and decode_error.start >= len(head) - 3:
+            return head[: decode_error.start].decode("utf-8")
+        return None
+
+
+def clip_line(line: str, n_cols: int) -> str:
+    """
+    Expands tabs in a line of highlighted text and cuts it to `n_cols`
+    visible columns. Color codes don't take up columns, and the ones past
+    the cut are kept so that colors are still reset.
+    """
+    pieces = []
+    col = 0
+    for i, piece in enumerate(_SGR_RE.split(line)):
+        if i % 2:
+            pieces.append(piece)
+            continue
+        visible = []
+        for char in piece:
+            if col >= n_cols:
+                break
+            if char == "\t":
+                width = min(
+                    TEXT_PREVIEW_TAB_SIZE - col % TEXT_PREVIEW_TAB_SIZE, n_cols - col
+                )
+                visible.append(" " * width)
+                col += width
+            else:
+                visible.append(char)
+                col += 1
+        pieces.append("".join(visible))
+    return "".join(pieces)
+
+
+def clip_lines(text: str, n_cols: int) -> str:
+    # Clipped after highlighting, as a lexer given cut-off lines can lose
+    # track of where strings and comments end
+    return "\n".join(clip_line(line, n_cols) for line in text.splitlines())
+
+
+def highlight_text(text: str, file_name: str) -> str:
+    try:
+        from pygments import highlight
+        from pygments.formatters import Terminal256Formatter
+        from pygments.lexers import get_lexer_for_filename
+        from pygments.util import ClassNotFound
+    except ImportError:
+        return text
+
+    try:
+        lexer = get_lexer_for_filename(file_name, stripnl=False)
+    except ClassNotFound:
+        return text
+
+    style = os.getenv("PYGMENTIZE_STYLE") or "autumn"
+    return highlight(text, lexer, Terminal256Formatter(style=style))
+
+
+def text_cache_path(cache_dir: Path, file_path: Path, n_cols: int) -> Path:
+    stat = file_path.stat()
+    key = "\0".join(
+        (os.fspath(file_path.resolve()), str(stat.st_mtime_ns), str(n_cols))
+    )
+    digest = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+    return cache_dir / f"{digest}.txt"
+
+
+def write_cache_file(cache_path: Path, data: bytes) -> None:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_fd, temp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(temp_fd, "wb") as writer:
+            writer.write(data)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def render_text_preview(source_path: Path, n_cols: int, cache_dir: Path, out) -> bool:
+    """
+    Writes a highlighted preview of the head of a text file to `out`, which
+    should be a binary stream. Returns False without writing anything if the
+    file looks binary.
+
+    Highlighted output is cached by path, mtime and pane width, so repeated
+    previews of the same file only cost a read of the cache file.
+    """
+    cache_path = text_cache_path(cache_dir, source_path, n_cols)
+    try:
+        out.write(cache_path.read_bytes())
+        return True
+    except FileNotFoundError:
+        pass
+
+    head = read_head(source_path)
+    text = decode_text_head(head, len(head) == TEXT_PREVIEW_MAX_BYTES)
+    if text is None:
+        return False
+
+    rendered = clip_lines(highlight_text(text, source_path.name), n_cols)
+    data = rendered.encode("utf-8")
+    try:
+        write_cache_file(cache_path, data)
+    except OSError:
+        pass
+    out.write(data)
+    return True
+
+
 def main():
     is_test = os.getenv("YELLCORP_TEST") == "1"
     if is_test:
@@ -94,11 +231,26 @@ def main():
         try:
             render_image_preview(args.file_path, args.image_cache_path)
             return ExitCode.PREVIEW_AS_IMAGE_AT_CACHE_PATH
+        except PIL.UnidentifiedImageError:
+            pass
         except Exception:
             if is_test:
                 raise
             else:
                 pass
+
+    try:
+        text_cache_dir = args.image_cache_path.parent / TEXT_PREVIEW_CACHE_DIR_NAME
+        if render_text_preview(
+            args.file_path, args.n_cols, text_cache_dir, sys.stdout.buffer
+        ):
+            # Output depends on the pane width, but not its height
+            return ExitCode.CONST_HEIGHT
+    except Exception:
+        if is_test:
+            raise
+        else:
+            pass
     return ExitCode.DECLINE
 
 
@@ -1,12 +1,30 @@
-import html
+import json
 import os.path
+import re
+import stat
 import subprocess
 import sys
-from argparse import ArgumentParser
+import time
+from argparse import ArgumentParser, ArgumentTypeError
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Optional
 
 from utils.errors import ErrorReporter
+from utils.text import format_size
+from utils.trashindex import TrashEntry, TrashIndex
+from utils.xdgtrash import (
+    DirectorySize,
+    FreedesktopTrash,
+    TrashDirectory,
+    TRASHINFO_DATE_FORMAT,
+    tree_size,
+    xdg_cache_home,
+)
+
+BACKEND_FINDER = "finder"
+BACKEND_FREEDESKTOP = "freedesktop"
 
 
 def get_arg_parser():
@@ -15,67 +33,184 @@ def get_arg_parser():
             Deletes files or folders by moving them to the Trash.
         """
     )
-    p.add_argument("files", nargs="+")
+    p.add_argument("files", nargs="*")
+    p.add_argument(
+        "--backend",
+        choices=(BACKEND_FINDER, BACKEND_FREEDESKTOP),
+        default=BACKEND_FINDER if sys.platform == "darwin" else BACKEND_FREEDESKTOP,
+        help="""
+            How to trash files. finder asks the macOS Finder to do it.
+            freedesktop moves them to the Trash described by the
+            freedesktop.org spec, as used by Linux desktops, in-process. The
+            default is %(default)s.
+        """,
+    )
+
+    manage = p.add_mutually_exclusive_group()
+    manage.add_argument(
+        "--list",
+        action="store_true",
+        help="""
+            List what's in the Trash, oldest first, with the date each item
+            was deleted and where it was deleted from.
+        """,
+    )
+    manage.add_argument(
+        "--restore",
+        help="""
+            Move items whose original path matches the glob PATTERN back to
+            where they were deleted from. A PATTERN without a / is matched
+            against the item's name. If several items were deleted from the
+            same path, the most recent is restored.
+        """,
+        metavar="PATTERN",
+    )
+    manage.add_argument(
+        "--du",
+        action="store_true",
+        help="""
+            Show how much space each item in the Trash takes, and the total.
+            The sizes of directories are cached, so only ones that haven't
+            been measured before are walked.
+        """,
+    )
+    manage.add_argument(
+        "--empty",
+        action="store_true",
+        help="""
+            Permanently delete what's in the Trash.
+        """,
+    )
+    p.add_argument(
+        "--older-than",
+        type=duration_arg,
+        help="""
+            With --empty, only delete items that were deleted more than AGE
+            ago. With --du, only count them, to show what --empty would free.
+            AGE is a number of days, or a number followed by s, m, h, d or w.
+        """,
+        metavar="AGE",
+    )
+
+    # --list, --restore, --du and --empty work from this, rather than reading
+    # every .trashinfo file each time
+    p.set_defaults(index=os.path.join(xdg_cache_home(), "shelpers", "trash.sqlite"))
     return p
 
 
-# [0] A crude html entity escaping is chosen because AppleScript has no
-#     built-in hex conversion, and HTML entities are an established scheme
-#     that can use base-10 for codepoints.
+DURATION_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
+
+
+def duration_arg(s):
+    match = re.fullmatch(r"(\d+)([smhdw]?)", s.strip(), re.IGNORECASE)
+    if match is None:
+        raise ArgumentTypeError(f"not a duration: {s!r}")
+    return int(match[1]) * DURATION_UNITS[match[2].lower() or "d"]
+
+
+# [0] Results are written to stdout, one JSON object per line, in the order
+#     the paths were given, as that's how they're matched up. JSON.stringify
+#     escapes everything that could break a line.
 #
-# [1] The `id` of a one-character string is a single integer. In all other
-#     cases, it's a list of integers. The id of a zero-character string is
-#     an empty list.
+# [1] Each batch is moved with a single Finder command, as every command is
+#     an Apple Event round trip. Paths that don't exist are left out of it
+#     and reported on their own.
 #
-# [2] Don't know why this is necessary, but if it's not done, integer
-#     equality never returns true. Got the idea from here
-#     https://github.com/mgax/applescript-json/blob/master/json.applescript
+# [2] The batch failed, so find out which of them did by trying each
+#     separately. Finder may have moved some before it gave up, so a file
+#     that's gone by then counts as trashed.
 #
-# [3] Characters to escape. Everything below space, plus line delimiters
-#     as understood by `str.splitlines`. Everything else including astral
-#     plane characters should be ok.
-#         32: space
-#         38: ampersand
-#        133: NEL (0x85)
-#       8232: line separator (0x2028)
-#       8233: paragraph separator (0x2029)
+# [3] Paths come in on stdin, separated by NULs, rather than as arguments,
+#     so there's no limit on their count or length.
 
 SCRIPT = """\
-on escapeString(theString) -- [0]
-    set escaped to ""
-
-    set codepoints to id of theString
-    if (class of codepoints) is not list
-        set codepoints to {codepoints} -- [1]
-    end
-
-    repeat with cc in codepoints
-        set cc to cc as integer -- [2]
-        if cc < 32 or cc = 38 or cc = 133 or cc = 8232 or cc = 8233 then -- [3]
-            set eseq to "&#" & cc & ";"
-        else
-            set eseq to character id cc
-        end
-        set escaped to escaped & eseq
-    end repeat
-    return escaped
-end
-
-on run argv
-    repeat with thePath in argv
-        log "fn:" & escapeString(thePath)
-        try
-            tell application "Finder" to move (thePath as POSIX file) to trash
-            log "ok:1"
-        on error errorText number errorNumber from errorSource
-            log "ok:0"
-            log "et:" & escapeString(errorText as text)
-            log "en:" & escapeString(errorNumber as text)
-        end try
-    end repeat
-end run
+ObjC.import("Foundation");
+
+const FILE_NOT_FOUND = -43;
+
+function exists(path) {
+    // Doesn't follow symlinks, unlike fileExistsAtPath
+    return !$.NSFileManager.defaultManager
+        .attributesOfItemAtPathError(path, null)
+        .isNil();
+}
+
+function report(path, error) { // [0]
+    const result = error === undefined
+        ? { path: path, ok: true }
+        : {
+            path: path,
+            ok: false,
+            error: String(error.message),
+            number: error.errorNumber === undefined ? "" : String(error.errorNumber),
+        };
+    $.NSFileHandle.fileHandleWithStandardOutput.writeData(
+        $(JSON.stringify(result) + "\\n").dataUsingEncoding($.NSUTF8StringEncoding)
+    );
+}
+
+function trashOne(finder, path) { // [2]
+    try {
+        finder.delete(Path(path));
+    } catch (error) {
+        if (exists(path)) {
+            return error;
+        }
+    }
+    return undefined;
+}
+
+function trashBatch(finder, paths) { // [1]
+    const present = paths.filter(exists);
+    let batchOK = true;
+    if (present.length > 0) {
+        try {
+            finder.delete(present.map((path) => Path(path)));
+        } catch (error) {
+            batchOK = false;
+        }
+    }
+
+    const isPresent = new Set(present);
+    for (const path of paths) {
+        if (!isPresent.has(path)) {
+            report(path, { message: "File not found", errorNumber: FILE_NOT_FOUND });
+        } else if (batchOK) {
+            report(path);
+        } else {
+            report(path, trashOne(finder, path));
+        }
+    }
+}
+
+function run(argv) { // [3]
+    const batchSize = parseInt(argv[0], 10);
+    const input = $.NSFileHandle.fileHandleWithStandardInput.readDataToEndOfFile;
+    const paths = $.NSString.alloc
+        .initWithDataEncoding(input, $.NSUTF8StringEncoding)
+        .js.split("\\0");
+    const finder = Application("Finder");
+    for (let start = 0; start < paths.length; start += batchSize) {
+        trashBatch(finder, paths.slice(start, start + batchSize));
+    }
+}
 """
 
+OSASCRIPT = "/usr/bin/osascript"
+
+# The number of files to move with each Finder command
+FINDER_BATCH_SIZE = 200
+
+
+def finder_command(batch_size: int = FINDER_BATCH_SIZE) -> list[str]:
+    return [OSASCRIPT, "-l", "JavaScript", "-e", SCRIPT, str(batch_size)]
+
 
 @dataclass
 class TrashResult:
@@ -85,139 +220,274 @@ class TrashResult:
     error_number: str = ""
 
 
-def split_line(line: str) -> tuple[str, str, str]:
-    return line[:2], line[2:3], line[3:]
+class ResultParser:
+    """
+    Parses the script's results as they arrive, one JSON object per line.
+    """
 
-
-class LineParser:
     def __init__(self, error_reporter: Optional[ErrorReporter] = None):
         self._error_reporter = error_reporter
-
-        self._state = 0
-        self._line_text = ""
-        self._line_n = -1
         self._panics = 0
 
-        self._result = TrashResult()
-        self._accepted: list[TrashResult] = []
-
-        self._dispatch = [
-            ("fn", self._parse_filename),
-            ("ok", self._parse_ok),
-            ("et", self._parse_error_text),
-            ("en", self._parse_error_number),
-        ]
-
     @property
     def protocol_error_count(self):
         return self._panics
 
-    def parse_lines(self, line_iter):
+    def parse_lines(self, line_iter) -> Iterator[TrashResult]:
         for line_n, line in enumerate(line_iter):
-            self._line_text = line
-            self._line_n = line_n
+            try:
+                fields = json.loads(line)
+                yield TrashResult(
+                    filename=fields["path"],
+                    ok=fields["ok"] is True,
+                    error_text=fields.get("error", ""),
+                    error_number=fields.get("number", ""),
+                )
+            except (ValueError, KeyError, TypeError) as parse_error:
+                self._panic(f"{parse_error}", line_n, line)
+
+    def _panic(self, message: str, line_n: int, line_text: str):
+        self._panics += 1
 
-            prefix, colon, detail_escaped = split_line(line.rstrip("\r\n"))
-            if colon != ":":
-                self._panic("Formatting error")
-                continue
+        if self._error_reporter is not None:
+            self._error_reporter.print_error(
+                f"{message} at line {line_n} line_text={line_text!r}"
+            )
 
-            detail = html.unescape(detail_escaped)
-            expected_prefix, handler = self._dispatch[self._state]
-            if prefix != expected_prefix:
-                self._panic(f"Wrong prefix: {expected_prefix=!r}")
-                continue
 
-            self._state += 1
-            handler(detail)
+def report_result(reporter: ErrorReporter, user_file: str, result: TrashResult):
+    if result.ok:
+        print(user_file)
+        return
 
-            if self._accepted:
-                yield from self._accepted
-                self._accepted.clear()
+    message = [
+        result.error_text or "<no error text>",
+    ]
 
-        if self._state != 0:
-            self._panic("Unexpected end of input")
+    if result.error_number:
+        message.append(f" ({result.error_number})")
 
-    def _parse_filename(self, detail: str):
-        if detail:
-            self._result.filename = detail
-        else:
-            self._panic("Empty filename")
-
-    def _parse_ok(self, detail: str):
-        if detail == "0":
-            self._result.ok = False
-        elif detail == "1":
-            self._result.ok = True
-            self._accept()
-        else:
-            self._panic("Invalid value for 'ok'")
+    reporter.print_error("".join(message), subject_file=user_file)
 
-    def _parse_error_text(self, detail: str):
-        self._result.error_text = detail
 
-    def _parse_error_number(self, detail: str):
-        self._result.error_number = detail
-        self._accept()
+def trash_freedesktop(files: list[str]) -> Iterator[TrashResult]:
+    trash = FreedesktopTrash()
+    for path in files:
+        try:
+            trash.trash(path)
+        except OSError as trash_error:
+            yield TrashResult(
+                filename=path,
+                error_text=trash_error.strerror or str(trash_error),
+                error_number=str(trash_error.errno or ""),
+            )
+        else:
+            yield TrashResult(filename=path, ok=True)
+
+
+def restore_from_trash(
+    index: TrashIndex,
+    trash_dirs: dict[str, TrashDirectory],
+    pattern: str,
+    reporter: ErrorReporter,
+) -> int:
+    # Entries come oldest first, so the last for each path is the newest
+    newest = {entry.original_path: entry for entry in index.matching(pattern)}
+    if not newest:
+        reporter.print_error(f"Nothing in the Trash matches {pattern!r}")
+        return 1
 
-    def _accept(self):
-        self._accepted.append(self._result)
-        self._reset()
+    removed: dict[str, dict[str, Optional[DirectorySize]]] = {}
+    failures = 0
+    for original, entry in newest.items():
+        try:
+            trash_dirs[entry.trash_dir].restore(entry.name, original)
+        except OSError as restore_error:
+            reporter.print_error(
+                restore_error.strerror or str(restore_error), subject_file=original
+            )
+            failures += 1
+        else:
+            index.remove(entry)
+            removed.setdefault(entry.trash_dir, {})[entry.name] = None
+            print(original)
+    update_directory_sizes(trash_dirs, removed)
+    return 1 if failures > 0 else 0
+
+
+def update_directory_sizes(
+    trash_dirs: dict[str, TrashDirectory],
+    changes: dict[str, dict[str, Optional[DirectorySize]]],
+):
+    for path, dir_changes in changes.items():
+        try:
+            trash_dirs[path].update_directory_sizes(dir_changes)
+        except OSError:
+            # Only a cache, so this isn't worth failing over
+            pass
+
+
+def entries_older_than(index: TrashIndex, age: Optional[int]) -> list[TrashEntry]:
+    if age is None:
+        return index.all()
+    cutoff = time.localtime(time.time() - age)
+    return index.deleted_before(time.strftime(TRASHINFO_DATE_FORMAT, cutoff))
+
+
+def trash_disk_usage(
+    index: TrashIndex,
+    trash_dirs: dict[str, TrashDirectory],
+    older_than: Optional[int],
+) -> int:
+    entries = entries_older_than(index, older_than)
+    cached = {
+        path: trash_dir.read_directory_sizes() for path, trash_dir in trash_dirs.items()
+    }
+
+    sizes: dict[TrashEntry, int] = {}
+    unmeasured: list[tuple[TrashEntry, int]] = []
+    for entry in entries:
+        trash_dir = trash_dirs[entry.trash_dir]
+        try:
+            item_stat = os.lstat(os.path.join(trash_dir.files_dir, entry.name))
+            if not stat.S_ISDIR(item_stat.st_mode):
+                sizes[entry] = item_stat.st_size
+                continue
+            info_mtime = trash_dir.info_mtime(entry.name)
+        except FileNotFoundError:
+            continue
+        cached_size = cached[entry.trash_dir].get(entry.name)
+        if cached_size is not None and cached_size.info_mtime == info_mtime:
+            sizes[entry] = cached_size.size
+        else:
+            unmeasured.append((entry, info_mtime))
+
+    # Walking a directory tree is mostly waiting on the filesystem, so
+    # several go at once
+    walked: dict[str, dict[str, Optional[DirectorySize]]] = {}
+    with ThreadPoolExecutor() as executor:
+        paths = (
+            os.path.join(trash_dirs[entry.trash_dir].files_dir, entry.name)
+            for entry, _ in unmeasured
+        )
+        for (entry, info_mtime), size in zip(
+            unmeasured, executor.map(tree_size, paths)
+        ):
+            sizes[entry] = size
+            walked.setdefault(entry.trash_dir, {})[entry.name] = DirectorySize(
+                size, info_mtime
+            )
+    update_directory_sizes(trash_dirs, walked)
 
-    def _panic(self, message: str):
-        self._panics += 1
+    for entry in entries:
+        if entry in sizes:
+            print(f"{format_size(sizes[entry]):>10}  {entry.original_path}")
+    print(f"{format_size(sum(sizes.values())):>10}  total, {len(sizes)} items")
+    return 0
 
-        if self._error_reporter is not None:
-            self._error_reporter.print_error(
-                f"{message} at line {self._line_n} line_text={self._line_text!r}"
-            )
-        self._reset()
 
-    def _reset(self):
-        self._result = TrashResult()
-        self._state = 0
+def empty_trash(
+    index: TrashIndex,
+    trash_dirs: dict[str, TrashDirectory],
+    older_than: Optional[int],
+    reporter: ErrorReporter,
+) -> int:
+    entries = entries_older_than(index, older_than)
+    removed: dict[str, dict[str, Optional[DirectorySize]]] = {}
+    failures = 0
+    for entry in entries:
+        try:
+            trash_dirs[entry.trash_dir].purge(entry.name)
+        except OSError as purge_error:
+            reporter.print_error(
+                "Could not delete", purge_error, subject_file=entry.original_path
+            )
+            failures += 1
+        else:
+            index.remove(entry)
+            removed.setdefault(entry.trash_dir, {})[entry.name] = None
+    update_directory_sizes(trash_dirs, removed)
+    return 1 if failures > 0 else 0
+
+
+def manage_trash(args, reporter: ErrorReporter) -> int:
+    trash_dirs = {
+        trash_dir.path: trash_dir
+        for trash_dir in FreedesktopTrash().trash_directories()
+    }
+    with TrashIndex(args.index) as index:
+        index.sync(trash_dirs.values())
+        if args.restore is not None:
+            return restore_from_trash(index, trash_dirs, args.restore, reporter)
+        if args.empty:
+            return empty_trash(index, trash_dirs, args.older_than, reporter)
+        if args.du:
+            return trash_disk_usage(index, trash_dirs, args.older_than)
+        for entry in index.all():
+            print(f"{entry.deleted}  {entry.original_path}")
+        return 0
 
 
 def main():
-    args = get_arg_parser().parse_args()
+    parser = get_arg_parser()
+    args = parser.parse_args()
     reporter = ErrorReporter.from_argv()
 
-    cmd = ["/usr/bin/osascript", "-"]
-    cmd.extend(os.path.abspath(p) for p in args.files)
+    if args.older_than is not None and not (args.empty or args.du):
+        parser.error("--older-than can only be used with --empty or --du")
+    if args.list or args.restore is not None or args.du or args.empty:
+        if args.files:
+            parser.error("files can't be given with --list, --restore, --du or --empty")
+        if args.backend != BACKEND_FREEDESKTOP:
+            parser.error(
+                "--list, --restore, --du and --empty need the freedesktop backend"
+            )
+        return manage_trash(args, reporter)
+    if not args.files:
+        parser.error("the following arguments are required: files")
+
+    if args.backend == BACKEND_FREEDESKTOP:
+        failures = 0
+        for user_file, result in zip(args.files, trash_freedesktop(args.files)):
+            report_result(reporter, user_file, result)
+            failures += not result.ok
+        return 1 if failures > 0 else 0
 
     script_proc = subprocess.Popen(
-        cmd,
+        finder_command(),
         bufsize=1,
-        text=True,
+        encoding="utf-8",
         stdin=subprocess.PIPE,
-        stdout=None,  # AppleScript 'log' outputs to stderr
-        stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=None,
     )
-    script_proc.stdin.write(SCRIPT)
+    # The script reads all of its input before it writes anything, so this
+    # can't fill the stdout pipe and deadlock
+    script_proc.stdin.write("\0".join(os.path.abspath(p) for p in args.files))
     script_proc.stdin.close()
 
-    parser = LineParser(reporter)
+    parser = ResultParser(reporter)
     consume_errors = 0
     failures = 0
-    for file_index, result in enumerate(parser.parse_lines(script_proc.stderr)):
+    result_count = 0
+    for file_index, result in enumerate(parser.parse_lines(script_proc.stdout)):
+        result_count += 1
         if file_index < len(args.files):
             user_file = args.files[file_index]
-            if result.ok:
-                print(user_file)
-            else:
-                message = [
-                    result.error_text or "<no error text>",
-                ]
-
-                if result.error_number:
-                    message.append(f" ({result.error_number})")
-
-                reporter.print_error("".join(message), subject_file=user_file)
+            report_result(reporter, user_file, result)
+            if not result.ok:
                 failures += 1
         else:
             consume_errors += 1
             reporter.print_error(f"Excess result: {result!r}")
 
+    script_proc.wait()
+    if result_count < len(args.files):
+        consume_errors += 1
+        reporter.print_error(
+            f"Missing results for {len(args.files) - result_count} files"
+        )
+
     if consume_errors > 0 or parser.protocol_error_count > 0:
         return 2
 
@@ -1,12 +1,54 @@
+import copy
+import dataclasses
 import enum
+import io
+import itertools
+import json
 import os
 import re
+import shutil
+import stat
 import subprocess
 import sys
-from argparse import ArgumentParser
-from collections.abc import Iterable
+import tempfile
+from argparse import ArgumentParser, ArgumentTypeError
+from collections.abc import Callable, Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import IO, Optional, TextIO, TypeVar
+
+from utils.archiveindex import (
+    disk_usage,
+    index_7z,
+    index_tar_stream,
+    index_zip,
+    MemberInfo,
+    xz_uncompressed_size,
+)
+from utils.argtypes import positive_int
+from utils.extract import (
+    COPY_CHUNK_SIZE,
+    decompress_stream,
+    ExpansionLimits,
+    Extractor,
+    ExtractStats,
+    find_command,
+    format_size,
+    is_complete,
+    is_tar_header,
+    MemberFilter,
+    NestedExtractFunction,
+    NestedHandler,
+    open_decompressed,
+    prefixed_reader,
+    TAR_BLOCK_SIZE,
+    TarExtractor,
+    UnsupportedArchiveError,
+    WarnFunction,
+    ZipExtractor,
+)
 
 
 def get_arg_parser():
@@ -20,10 +62,23 @@ def get_arg_parser():
         "files",
         nargs="+",
         help="""
-            Files to extract.
+            Files to extract. A file named - is read from standard input,
+            as it arrives, and extracted to a directory named by --name.
         """,
     )
 
+    p.add_argument(
+        "--name",
+        default="stdin",
+        help="""
+            The name of the archive read from standard input, which is
+            extracted to a directory named NAME.d. If the archive is a
+            compressed file that isn't a tar, it's also what the file it
+            decompresses to is named after. The default is %(default)s.
+        """,
+        metavar="NAME",
+    )
+
     p.add_argument(
         "--delete",
         action="store_true",
@@ -32,98 +87,725 @@ def get_arg_parser():
         """,
     )
 
+    p.add_argument(
+        "--jobs",
+        "-j",
+        type=positive_int,
+        default=1,
+        help="""
+            The number of archives to extract at once. When more than one,
+            each archive's output is collected and printed when it finishes,
+            in the order the archives were given. The default is %(default)s.
+        """,
+        metavar="N",
+    )
+
+    p.add_argument(
+        "--resume",
+        action="store_true",
+        help="""
+            Continue an extraction that was interrupted, instead of skipping
+            archives whose directory already exists. Files that are already
+            complete, going by their size and modification time, are kept,
+            and only the rest are extracted.
+        """,
+    )
+
+    p.add_argument(
+        "--include",
+        "-i",
+        action="append",
+        default=[],
+        help="""
+            Only extract members whose path within the archive matches GLOB,
+            where * also matches /. May be given more than once, to extract
+            members matching any of them. With zip and 7z archives, the
+            members that aren't selected aren't read at all.
+        """,
+        metavar="GLOB",
+    )
+
+    p.add_argument(
+        "--exclude",
+        "-x",
+        action="append",
+        default=[],
+        help="""
+            Don't extract members whose path within the archive matches GLOB.
+            May be given more than once. Takes precedence over --include.
+        """,
+        metavar="GLOB",
+    )
+
+    p.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="""
+            Also extract archives found inside archives. Each is read
+            straight from the archive containing it, without being written
+            out first, and extracted to a directory named after it with .d
+            appended.
+        """,
+    )
+
+    p.add_argument(
+        "--max-depth",
+        type=positive_int,
+        default=4,
+        help="""
+            With --recursive, the number of levels of archives within
+            archives to extract. Archives nested deeper are written out as
+            files. The default is %(default)s.
+        """,
+        metavar="N",
+    )
+
+    p.add_argument(
+        "--max-size",
+        type=size_arg,
+        default="64G",
+        help="""
+            With --recursive, stop extracting an archive if it and the
+            archives inside it expand to more than SIZE in total. This
+            guards against zip bombs. SIZE may have a K, M, G or T suffix.
+            The default is %(default)s.
+        """,
+        metavar="SIZE",
+    )
+
+    p.add_argument(
+        "--list",
+        "-l",
+        action="store_true",
+        help="""
+            List the members of each archive, with their sizes, instead of
+            extracting it. Only headers are read where the format allows,
+            but compressed tars have to be decompressed to reach theirs.
+        """,
+    )
+
+    p.add_argument(
+        "--stats",
+        action="store_true",
+        help="""
+            Print each archive's total expanded size, compression ratio and
+            the disk space it needs, instead of extracting it.
+        """,
+    )
+
+    p.add_argument(
+        "--json",
+        action="store_true",
+        help="""
+            With --list or --stats, print a JSON object per archive, one per
+            line.
+        """,
+    )
+
+    p.add_argument(
+        "--no-space-check",
+        dest="check_space",
+        action="store_false",
+        help="""
+            Extract even if there doesn't seem to be enough free space. By
+            default, an archive is skipped if its listing can be read
+            cheaply and shows it won't fit.
+        """,
+    )
+
     return p
 
 
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def size_arg(s):
+    match = re.fullmatch(r"(\d+)([KMGT]?)(?:i?B)?", s.strip(), re.IGNORECASE)
+    if match is None:
+        raise ArgumentTypeError(f"not a size: {s!r}")
+    return int(match[1]) * SIZE_UNITS[match[2].upper()]
+
+
 class ArchiveFormat(enum.Enum):
+    AR = enum.auto()
     BZIP2 = enum.auto()
+    CPIO = enum.auto()
     GZIP = enum.auto()
+    LZ4 = enum.auto()
+    LZIP = enum.auto()
     RAR = enum.auto()
     SEVENZ = enum.auto()
     TAR = enum.auto()
     XZ = enum.auto()
     ZIP = enum.auto()
+    ZSTD = enum.auto()
+
+
+# Checked in order against the start of the file. Each is an offset and a
+# pattern that must match there.
+SIGNATURES = (
+    (0, rb"\xfd7zXZ\x00", ArchiveFormat.XZ),
+    (0, rb"Rar!\x1a\x07", ArchiveFormat.RAR),
+    (0, rb"7z\xbc\xaf'\x1c", ArchiveFormat.SEVENZ),
+    (0, rb"\x1f\x8b", ArchiveFormat.GZIP),
+    (0, rb"BZ[h0][1-9]", ArchiveFormat.BZIP2),
+    (0, rb"PK(\x03\x04|\x05\x06|\x07\x08)", ArchiveFormat.ZIP),
+    (0, rb"\x28\xb5\x2f\xfd", ArchiveFormat.ZSTD),
+    # lz4 frame format, then the legacy format
+    (0, rb"\x04\x22\x4d\x18|\x02\x21\x4c\x18", ArchiveFormat.LZ4),
+    (0, rb"LZIP", ArchiveFormat.LZIP),
+    (0, rb"!<arch>\n", ArchiveFormat.AR),
+    # New ASCII, new ASCII with CRC and old ASCII
+    (0, rb"07070[127]", ArchiveFormat.CPIO),
+    (257, rb"ustar[\x00\x20]", ArchiveFormat.TAR),
+    (508, rb"tar\x00", ArchiveFormat.TAR),
+    # Old binary cpio in either byte order. Only two bytes, so it comes last.
+    (0, rb"\xc7\x71|\x71\xc7", ArchiveFormat.CPIO),
+)
+SIGNATURE_READ_SIZE = 512
+
+# Decompressors for each compressed format, in order of preference. Ones
+# that use several threads come first. gzip, bzip2 and xz can fall back to
+# the standard library if none are installed.
+DECOMPRESS_COMMANDS = {
+    ArchiveFormat.BZIP2: (("pbzip2", "-dc"),),
+    ArchiveFormat.GZIP: (("pigz", "-dc"),),
+    ArchiveFormat.LZ4: (("lz4", "-dc"),),
+    ArchiveFormat.LZIP: (("plzip", "-dc"), ("lzip", "-dc")),
+    ArchiveFormat.XZ: (("xz", "-dc", "-T0"),),
+    ArchiveFormat.ZSTD: (("zstd", "-dc", "-T0"),),
+}
 
-
-def extract_tar(archive: Path, out_dir: Path):
-    subprocess.run(
-        ["tar", "-xvf", archive.absolute()],
-        cwd=out_dir,
-        check=True,
-    )
-
-
-def extract_7z(archive: Path, out_dir: Path):
-    subprocess.run(
-        ["7z", "x", f"-o{os.curdir}", archive.absolute()], cwd=out_dir, check=True
+# Formats that can be decompressed in-process if none of their commands are
+# installed
+STDLIB_DECOMPRESSED = frozenset(
+    (ArchiveFormat.BZIP2, ArchiveFormat.GZIP, ArchiveFormat.XZ)
+)
+
+# Zip files nested inside other archives, up to this size, are read into
+# memory to be extracted
+NESTED_ZIP_MEMORY_MAX = 64 * 1024 * 1024
+
+DEFAULT_BLOCK_SIZE = 4096
+
+COMPRESSED_SUFFIXES = (".bz2", ".gz", ".lz", ".lz4", ".xz", ".zst")
+
+STDIN_FILE = "-"
+
+
+def run_tool(args: list, cwd: Path, out: TextIO):
+    """
+    Runs an external extractor in `cwd`. Its output goes straight to the
+    terminal if `out` is stdout, otherwise it's captured and written to
+    `out`.
+    """
+    if out is sys.stdout:
+        subprocess.run(args, cwd=cwd, check=True)
+        return
+    result = subprocess.run(
+        args,
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        errors="replace",
     )
-
-
-def extract_zip(archive: Path, out_dir: Path):
-    subprocess.run(
-        ["unzip", archive.absolute(), "-d", os.curdir], cwd=out_dir, check=True
+    out.write(result.stdout)
+    result.check_returncode()
+
+
+E = TypeVar("E", bound=Extractor)
+
+
+@dataclass
+class ExtractContext:
+    """
+    Everything an extractor needs besides the archive and the directory to
+    extract it to.
+    """
+
+    warn: WarnFunction
+    out: TextIO
+    limits: ExpansionLimits = field(default_factory=ExpansionLimits)
+    nested: Optional[NestedHandler] = None
+    resume: bool = False
+    select: Optional[MemberFilter] = None
+
+    def extractor(self, extractor_class: type[E], out_dir) -> E:
+        return extractor_class(
+            out_dir,
+            self.warn,
+            self.nested,
+            self.limits,
+            resume=self.resume,
+            select=self.select,
+        )
+
+
+def index_tar(archive: Path) -> list[MemberInfo]:
+    with open(archive, "rb") as stream:
+        return index_tar_stream(stream)
+
+
+def index_compressed(
+    commands: Iterable[Sequence[str]], archive: Path
+) -> list[MemberInfo]:
+    with open_decompressed(archive, commands) as stream:
+        head = stream.read(TAR_BLOCK_SIZE)
+        source = prefixed_reader(head, stream)
+        if is_tar_header(head):
+            return index_tar_stream(source)
+        size = sum(map(len, iter(partial(source.read, COPY_CHUNK_SIZE), b"")))
+    return [MemberInfo(decompressed_name(archive.name), size, archive.stat().st_size)]
+
+
+def extract_tar(archive: Path, out_dir: Path, context: ExtractContext):
+    stats = context.extractor(TarExtractor, out_dir).extract_file(archive)
+    print(stats.summary(), file=context.out)
+    stats.raise_for_skipped()
+
+
+def decompressed_name(archive_name: str) -> str:
+    """
+    Returns the name for the decompressed contents of a compressed file
+    that isn't a tar, removing its compression suffix as gunzip would.
+    """
+    stem, suffix = os.path.splitext(archive_name)
+    if stem and suffix.lower() in COMPRESSED_SUFFIXES:
+        return stem
+    return archive_name + ".out"
+
+
+def extract_decompressed(
+    stream: IO[bytes], out_dir, name: str, context: ExtractContext
+) -> ExtractStats:
+    """
+    Extracts the decompressed contents of the compressed file `name`. If
+    they aren't a tar, they're written to a single file.
+    """
+    head = stream.read(TAR_BLOCK_SIZE)
+    source = prefixed_reader(head, stream)
+    if is_tar_header(head):
+        return context.extractor(TarExtractor, out_dir).extract_fileobj(source)
+
+    extractor = context.extractor(Extractor, out_dir)
+    extractor.write_file(
+        os.path.join(out_dir, decompressed_name(name)),
+        iter(partial(source.read, COPY_CHUNK_SIZE), b""),
+        0o644,
+        None,
     )
-
-
-EXTRACTORS = {
-    ArchiveFormat.BZIP2: extract_tar,
-    ArchiveFormat.GZIP: extract_tar,
+    return extractor.finish()
+
+
+def extract_compressed(
+    commands: Iterable[Sequence[str]],
+    archive: Path,
+    out_dir: Path,
+    context: ExtractContext,
+):
+    """
+    Extracts a compressed tar, or if the contents aren't a tar, decompresses
+    them to a single file.
+    """
+    with open_decompressed(archive, commands) as stream:
+        stats = extract_decompressed(stream, out_dir, archive.name, context)
+    print(stats.summary(), file=context.out)
+    stats.raise_for_skipped()
+
+
+def extract_7z(archive: Path, out_dir: Path, context: ExtractContext):
+    args = ["7z", "x", f"-o{os.curdir}", archive.absolute()]
+    if not (context.resume or context.select):
+        run_tool(args, out_dir, context.out)
+        return
+
+    # The members to extract are picked from the listing, which 7z reads
+    # from the archive's headers, and passed to it by name, so that it
+    # doesn't read the others. The listing doesn't give mtimes in a reliable
+    # form, so when resuming, files are judged complete by size alone.
+    wanted = [
+        member.name
+        for member in index_7z(archive)
+        if not member.is_dir
+        and (context.select is None or context.select(member.name))
+        and not (
+            context.resume
+            and is_complete(os.path.join(out_dir, member.name), member.size, None)
+        )
+    ]
+    if not wanted:
+        print("Nothing to extract", file=context.out)
+        return
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt") as names:
+        names.write("".join(f"{name}\n" for name in wanted))
+        names.flush()
+        # Overwrite partial files, treat names literally, and read the list
+        # as UTF-8
+        args += ["-aoa", "-spd", "-scsUTF-8", f"@{names.name}"]
+        run_tool(args, out_dir, context.out)
+
+
+def extract_zip_subprocess(archive: Path, out_dir: Path, context: ExtractContext):
+    args = ["unzip", archive.absolute(), "-d", os.curdir]
+    if context.resume:
+        # Without this, unzip asks about every file that exists
+        args.insert(1, "-o")
+    if context.select:
+        # unzip's wildcards also match across /, like MemberFilter's
+        args += context.select.include_patterns
+        if context.select.exclude_patterns:
+            args += ["-x", *context.select.exclude_patterns]
+    run_tool(args, out_dir, context.out)
+
+
+def extract_zip(archive: Path, out_dir: Path, context: ExtractContext):
+    extractor = context.extractor(ZipExtractor, out_dir)
+    try:
+        stats = extractor.extract_file(archive)
+    except UnsupportedArchiveError as unsupported:
+        # Encrypted, or compressed with something like Deflate64
+        context.warn(f"{os.fspath(archive)!r}: {unsupported}. Falling back to unzip.")
+        extract_zip_subprocess(archive, out_dir, context)
+        return
+    print(stats.summary(), file=context.out)
+    stats.raise_for_skipped()
+
+
+def extract_stream(
+    stream: IO[bytes], out_dir: Path, name: str, context: ExtractContext
+):
+    """
+    Extracts an archive from a stream that can't seek, such as a pipe, as
+    `name`. Tars and compressed files are extracted as they're read. Other
+    formats need random access, so they're copied to a temporary file next
+    to `out_dir` first.
+    """
+    head = stream.read(SIGNATURE_READ_SIZE)
+    arc_format = identify_head(head)
+    if arc_format is ArchiveFormat.TAR:
+        extractor = context.extractor(TarExtractor, out_dir)
+        stats = extractor.extract_fileobj(prefixed_reader(head, stream))
+    elif arc_format in DECOMPRESS_COMMANDS:
+        commands = DECOMPRESS_COMMANDS[arc_format]
+        with decompress_stream(stream, head, commands) as decompressed:
+            stats = extract_decompressed(decompressed, out_dir, name, context)
+    else:
+        with tempfile.NamedTemporaryFile(
+            dir=out_dir.parent, prefix=".", suffix=Path(name).suffix
+        ) as spool:
+            spool.write(head)
+            shutil.copyfileobj(stream, spool, COPY_CHUNK_SIZE)
+            spool.flush()
+            extractor_function = EXTRACTORS.get(arc_format, EXTRACTORS[None])
+            extractor_function(Path(spool.name), out_dir, context)
+        return
+    print(stats.summary(), file=context.out)
+    stats.raise_for_skipped()
+
+
+ExtractorFunction = Callable[[Path, Path, ExtractContext], None]
+
+EXTRACTORS: dict[Optional[ArchiveFormat], ExtractorFunction] = {
+    **{
+        arc_format: partial(extract_compressed, commands)
+        for arc_format, commands in DECOMPRESS_COMMANDS.items()
+    },
+    ArchiveFormat.AR: extract_7z,
+    ArchiveFormat.CPIO: extract_7z,
     ArchiveFormat.RAR: extract_7z,
     ArchiveFormat.SEVENZ: extract_7z,
     ArchiveFormat.TAR: extract_tar,
-    ArchiveFormat.XZ: extract_tar,
     ArchiveFormat.ZIP: extract_zip,
     None: extract_7z,
 }
 
 
-def identify_file(file: os.PathLike):
-    with open(file, "rb") as reader:
-        b = reader.read(6)
-        if b == b"\xFD\x37\x7A\x58\x5A\x00":
-            return ArchiveFormat.XZ
-        if b == b"Rar!\x1a\x07":
-            return ArchiveFormat.RAR
-        if b == b"7z\xbc\xaf'\x1c":
-            return ArchiveFormat.SEVENZ
-        if b.startswith(b"\x1f\x8B"):
-            return ArchiveFormat.GZIP
-        if re.match(rb"^BZ[h0][1-9]", b):
-            return ArchiveFormat.BZIP2
-        if re.match(rb"^PK(\x03\x04|\x05\x06|\x07\x08)", b):
-            return ArchiveFormat.ZIP
-
-        reader.seek(257)
-        b = reader.read(6)
-        if re.match(rb"^ustar[\x00\x20]", b):
-            return ArchiveFormat.TAR
-
-        reader.seek(508)
-        b = reader.read(4)
-        if b == b"tar\x00":
-            return ArchiveFormat.TAR
+IndexFunction = Callable[[Path], list[MemberInfo]]
 
+INDEXERS: dict[Optional[ArchiveFormat], IndexFunction] = {
+    **{
+        arc_format: partial(index_compressed, commands)
+        for arc_format, commands in DECOMPRESS_COMMANDS.items()
+    },
+    ArchiveFormat.TAR: index_tar,
+    ArchiveFormat.ZIP: index_zip,
+    None: index_7z,
+}
+
+# Formats whose listing can be read without decompressing everything, so
+# it's cheap enough to check free space before extracting
+HEADER_INDEXED = frozenset(
+    (
+        ArchiveFormat.AR,
+        ArchiveFormat.CPIO,
+        ArchiveFormat.RAR,
+        ArchiveFormat.SEVENZ,
+        ArchiveFormat.TAR,
+        ArchiveFormat.ZIP,
+    )
+)
+
+
+def block_size_for(dir: Path) -> int:
+    try:
+        return os.statvfs(dir).f_frsize or DEFAULT_BLOCK_SIZE
+    except OSError:
+        return DEFAULT_BLOCK_SIZE
+
+
+def select_members(
+    index: list[MemberInfo], select: Optional[MemberFilter]
+) -> list[MemberInfo]:
+    if not select:
+        return index
+    return [member for member in index if select(member.name)]
+
+
+def unfinished_members(index: list[MemberInfo], out_dir: Path) -> list[MemberInfo]:
+    """
+    Returns the members that an earlier extraction into `out_dir` didn't
+    finish, judging files by size alone, as not every index has mtimes.
+    """
+    unfinished = []
+    for member in index:
+        path = os.path.join(out_dir, member.name)
+        if member.is_dir:
+            if not os.path.isdir(path):
+                unfinished.append(member)
+        elif not is_complete(path, member.size, None):
+            unfinished.append(member)
+    return unfinished
+
+
+def estimate_disk_usage(
+    archive: Path,
+    arc_format: Optional[ArchiveFormat],
+    select: Optional[MemberFilter] = None,
+    resume_dir: Optional[Path] = None,
+):
+    """
+    Estimates the disk space that extracting an archive, or the members of
+    it that `select` picks, will take, or returns None if that can't be done
+    without decompressing it. Members that an earlier extraction already
+    finished in `resume_dir` aren't counted.
+    """
+    if resume_dir is not None and not resume_dir.is_dir():
+        resume_dir = None
+    if arc_format in HEADER_INDEXED:
+        indexer = INDEXERS.get(arc_format, INDEXERS[None])
+        if indexer is index_7z and not shutil.which("7z"):
+            return None
+        index = select_members(indexer(archive), select)
+        if resume_dir is not None:
+            index = unfinished_members(index, resume_dir)
+        return disk_usage(index, block_size_for(archive.parent))
+    if (
+        arc_format is ArchiveFormat.XZ
+        and shutil.which("xz")
+        and not (select or resume_dir)
+    ):
+        # xz records the uncompressed size in its index. This doesn't
+        # allow for block rounding, but is close for most tars.
+        return xz_uncompressed_size(archive)
+    return None
+
+
+def format_ratio(packed_size: Optional[int], size: int) -> str:
+    if packed_size is None or size == 0:
+        return "-"
+    return f"{100 * packed_size / size:.0f}%"
+
+
+def identify_head(head: bytes) -> Optional[ArchiveFormat]:
+    for offset, pattern, arc_format in SIGNATURES:
+        if re.compile(pattern).match(head, offset):
+            return arc_format
+    return None
+
+
+def identify_file(file: os.PathLike) -> Optional[ArchiveFormat]:
+    with open(file, "rb") as reader:
+        return identify_head(reader.read(SIGNATURE_READ_SIZE))
+
+
+class NestedArchives:
+    """
+    Recognizes archives among the members of another archive, and extracts
+    them straight from the outer archive's stream to a directory named
+    after the member with .d appended, in place of the member itself.
+    `context` is the top level's, and `depth` is the nesting level of the
+    archives this handles, where the archives named on the command line are
+    level 0.
+    """
+
+    def __init__(self, context: ExtractContext, depth: int = 1):
+        self.context = context
+        self.out = context.out
+        self.limits = context.limits
+        self.depth = depth
+
+    def __call__(self, head: bytes) -> Optional[NestedExtractFunction]:
+        if self.depth > self.limits.max_depth:
+            return None
+        arc_format = identify_head(head)
+        if arc_format is ArchiveFormat.TAR:
+            return self.extract_tar
+        if arc_format is ArchiveFormat.ZIP:
+            return self.extract_zip
+        if arc_format in DECOMPRESS_COMMANDS:
+            commands = DECOMPRESS_COMMANDS[arc_format]
+            if arc_format in STDLIB_DECOMPRESSED or find_command(commands):
+                return partial(self.extract_compressed, commands)
+        # Anything else needs an external tool that reads from a file
         return None
 
+    def inner_context(self) -> ExtractContext:
+        """
+        Returns the context for extracting the members of archives at this
+        level.
+        """
+        inner = NestedArchives(self.context, self.depth + 1)
+        # --include and --exclude only apply to the archives given
+        return dataclasses.replace(self.context, nested=inner, select=None)
+
+    def make_out_dir(self, path: str) -> str:
+        out_dir = path + ".d"
+        print(f"{path!r} -> {out_dir!r}", file=self.out)
+        try:
+            os.mkdir(out_dir)
+        except FileExistsError:
+            if not (self.context.resume and stat.S_ISDIR(os.lstat(out_dir).st_mode)):
+                raise
+        return out_dir
+
+    def extract_tar(self, stream: IO[bytes], path: str) -> ExtractStats:
+        out_dir = self.make_out_dir(path)
+        return (
+            self.inner_context()
+            .extractor(TarExtractor, out_dir)
+            .extract_fileobj(stream)
+        )
+
+    def extract_compressed(
+        self, commands: Iterable[Sequence[str]], stream: IO[bytes], path: str
+    ) -> ExtractStats:
+        out_dir = self.make_out_dir(path)
+        head = stream.read(SIGNATURE_READ_SIZE)
+        with decompress_stream(stream, head, commands) as decompressed:
+            return extract_decompressed(
+                decompressed, out_dir, os.path.basename(path), self.inner_context()
+            )
+
+    def extract_zip(self, stream: IO[bytes], path: str) -> ExtractStats:
+        # Zip files can only be read with random access, so this is the one
+        # format that has to be held in full. Small ones are kept in memory,
+        # and larger ones in an anonymous temporary file.
+        out_dir = self.make_out_dir(path)
+        extractor = self.inner_context().extractor(ZipExtractor, out_dir)
+        data = stream.read(NESTED_ZIP_MEMORY_MAX + 1)
+        if len(data) <= NESTED_ZIP_MEMORY_MAX:
+            return extractor.extract_data(data)
+
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), prefix=".", suffix=".zip"
+        ) as spool:
+            for chunk in itertools.chain(
+                (data,), iter(partial(stream.read, COPY_CHUNK_SIZE), b"")
+            ):
+                self.limits.charge(len(chunk))
+                spool.write(chunk)
+            spool.flush()
+            return extractor.extract_file(spool.name)
+
 
 class Runner:
-    def __init__(self, argv0: Optional[str]):
+    def __init__(
+        self,
+        argv0: Optional[str],
+        out: TextIO = sys.stdout,
+        err: TextIO = sys.stderr,
+        recursive: bool = False,
+        max_depth: int = 0,
+        max_size: Optional[int] = None,
+        check_space: bool = True,
+        resume: bool = False,
+        select: Optional[MemberFilter] = None,
+        stdin_name: str = "stdin",
+    ):
+        self.argv0 = argv0
         self.warn_prefix = f"{argv0}: " if argv0 else ""
+        self.out = out
+        self.err = err
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.check_space = check_space
+        self.resume = resume
+        self.select = select
+        self.stdin_name = stdin_name
 
     def warn(self, message: str):
-        print(f"{self.warn_prefix}{message}", file=sys.stderr)
-
-    def extract_all(self, files: Iterable[os.PathLike], delete_archives: bool):
-        for f in files:
-            self.extract(f, delete_archives)
+        print(f"{self.warn_prefix}{message}", file=self.err)
+
+    def extract_all(
+        self, files: Iterable[os.PathLike], delete_archives: bool, jobs: int = 1
+    ):
+        if jobs == 1:
+            for f in files:
+                self.extract(f, delete_archives)
+            return
+
+        extract = partial(self.extract_buffered, delete_on_success=delete_archives)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # Each archive's output is held until those listed before it
+            # have been written, so that it comes out in command-line order
+            for _, out_text, err_text in executor.map(extract, files):
+                self.out.write(out_text)
+                self.err.write(err_text)
+                self.out.flush()
+                self.err.flush()
+
+    def extract_buffered(
+        self, archive_file: os.PathLike, delete_on_success: bool
+    ) -> tuple[bool, str, str]:
+        """
+        Extracts one archive on a copy of this Runner whose output goes to
+        strings, and returns (ok, stdout_text, stderr_text).
+        """
+        out = io.StringIO()
+        err = io.StringIO()
+        runner = copy.copy(self)
+        runner.out = out
+        runner.err = err
+        ok = runner.extract(archive_file, delete_on_success)
+        return ok, out.getvalue(), err.getvalue()
 
     def extract(self, archive_file: os.PathLike, delete_on_success: bool) -> bool:
-        archive_path = Path(archive_file)
+        from_stdin = os.fspath(archive_file) == STDIN_FILE
+        archive_path = Path(self.stdin_name if from_stdin else archive_file)
         out_dir = self.dir_for_archive_file(archive_path)
         if not self.should_extract_to(out_dir):
             self.warn(f"Skipping: {os.fspath(archive_path)!r}")
             return False
-        out_dir.mkdir(parents=True, exist_ok=True)
+        # Standard input can't be listed ahead of extracting it
+        if (
+            self.check_space
+            and not from_stdin
+            and not self.has_space_for(archive_path, out_dir)
+        ):
+            self.warn(f"Skipping: {os.fspath(archive_path)!r}")
+            return False
+        try:
+            out_dir.mkdir(parents=True, exist_ok=self.resume)
+        except FileExistsError:
+            # Another job got there first
+            self.warn(f"Exists: {os.fspath(out_dir)!r}")
+            self.warn(f"Skipping: {os.fspath(archive_path)!r}")
+            return False
+        if from_stdin:
+            return self._do_extract_stdin(archive_path, out_dir)
         ok = self._do_extract(archive_path, out_dir)
         if ok and delete_on_success:
             try:
@@ -134,33 +816,151 @@ class Runner:
                 self.warn(f"Deleting {os.fspath(archive_path)!r}: {del_exc}")
         return ok
 
+    def has_space_for(self, archive: Path, out_dir: Path) -> bool:
+        try:
+            needed = estimate_disk_usage(
+                archive,
+                identify_file(archive),
+                self.select,
+                out_dir if self.resume else None,
+            )
+            free = shutil.disk_usage(out_dir.parent).free
+        except Exception as estimate_exc:
+            # Extraction will report anything serious
+            self.warn(f"Checking space for {os.fspath(archive)!r}: {estimate_exc}")
+            return True
+        if needed is not None and needed > free:
+            self.warn(
+                f"Not enough space for {os.fspath(archive)!r}: needs"
+                f" {format_size(needed)}, {format_size(free)} free"
+            )
+            return False
+        return True
+
+    def list_all(self, files: Iterable[os.PathLike], members: bool, as_json: bool):
+        for f in files:
+            self.list(f, members, as_json)
+
+    def list(self, archive_file: os.PathLike, members: bool, as_json: bool) -> bool:
+        """
+        Prints the contents of an archive, or with `members` false, just
+        its totals.
+        """
+        archive_path = Path(archive_file)
+        try:
+            arc_format = identify_file(archive_path)
+            index = INDEXERS.get(arc_format, INDEXERS[None])(archive_path)
+            index = select_members(index, self.select)
+            packed_size = archive_path.stat().st_size
+        except Exception as list_exc:
+            self.warn(f"{os.fspath(archive_path)!r}: {list_exc}")
+            return False
+
+        size = sum(member.size for member in index)
+        usage = disk_usage(index, block_size_for(archive_path.parent))
+
+        if as_json:
+            summary: dict = {
+                "archive": os.fspath(archive_path),
+                "format": arc_format.name.lower() if arc_format else None,
+                "member_count": len(index),
+                "size": size,
+                "packed_size": packed_size,
+                "disk_usage": usage,
+            }
+            if members:
+                summary["members"] = [member._asdict() for member in index]
+            print(json.dumps(summary), file=self.out)
+            return True
+
+        print(f"{os.fspath(archive_path)!r}:", file=self.out)
+        if members:
+            print(f"{'Size':>10} {'Packed':>10} {'Ratio':>5}  Name", file=self.out)
+            for member in index:
+                packed = (
+                    "-"
+                    if member.packed_size is None
+                    else format_size(member.packed_size)
+                )
+                print(
+                    f"{format_size(member.size):>10} {packed:>10}"
+                    f" {format_ratio(member.packed_size, member.size):>5}"
+                    f"  {member.name}",
+                    file=self.out,
+                )
+        print(
+            f"{len(index)} members, {format_size(size)} expanded from"
+            f" {format_size(packed_size)} ({format_ratio(packed_size, size)}),"
+            f" needs {format_size(usage)} on disk",
+            file=self.out,
+        )
+        return True
+
     def dir_for_archive_file(self, file: Path) -> Path:
         return file.parent / f"{file.name}.d"
 
     def should_extract_to(self, dir: Path) -> bool:
         if dir.exists():
+            if self.resume and dir.is_dir():
+                print(f"Resuming: {os.fspath(dir)!r}", file=self.out)
+                return True
             self.warn(f"Exists: {os.fspath(dir)!r}")
             return False
         return True
 
+    def context(self) -> ExtractContext:
+        context = ExtractContext(
+            self.warn, self.out, resume=self.resume, select=self.select
+        )
+        if self.recursive:
+            context.limits = ExpansionLimits(self.max_depth, self.max_size)
+            context.nested = NestedArchives(context)
+        return context
+
     def _do_extract(self, archive: Path, out_dir: Path) -> bool:
-        print(f"{os.fspath(archive)!r} -> {os.fspath(out_dir)!r}")
+        print(f"{os.fspath(archive)!r} -> {os.fspath(out_dir)!r}", file=self.out)
         # TODO: force extract type
         try:
             arc_type = identify_file(archive)
             extractor = EXTRACTORS.get(arc_type, EXTRACTORS[None])
-            extractor(archive, out_dir)
+            extractor(archive, out_dir, self.context())
         except Exception as extract_exc:
             self.warn("{}: {}".format(repr(os.fspath(archive)), extract_exc))
             return False
         return True
 
+    def _do_extract_stdin(self, archive: Path, out_dir: Path) -> bool:
+        print(f"(standard input) -> {os.fspath(out_dir)!r}", file=self.out)
+        try:
+            extract_stream(sys.stdin.buffer, out_dir, archive.name, self.context())
+        except Exception as extract_exc:
+            self.warn(f"(standard input): {extract_exc}")
+            return False
+        return True
+
 
 def main():
     argv0 = Path(__file__).name
-    args = get_arg_parser().parse_args()
-    runner = Runner(argv0)
-    runner.extract_all(args.files, args.delete)
+    parser = get_arg_parser()
+    args = parser.parse_args()
+    if args.files.count(STDIN_FILE) > 1:
+        parser.error(f"{STDIN_FILE} can only be given once")
+    if STDIN_FILE in args.files and (args.list or args.stats):
+        parser.error(f"{STDIN_FILE} can't be used with --list or --stats")
+    runner = Runner(
+        argv0,
+        recursive=args.recursive,
+        max_depth=args.max_depth,
+        max_size=args.max_size,
+        check_space=args.check_space,
+        resume=args.resume,
+        select=MemberFilter(args.include, args.exclude) or None,
+        stdin_name=args.name,
+    )
+    if args.list or args.stats:
+        runner.list_all(args.files, args.list, args.json)
+    else:
+        runner.extract_all(args.files, args.delete, args.jobs)
 
 
 if __name__ == "__main__":
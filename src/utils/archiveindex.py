@@ -0,0 +1,115 @@
+"""
+Listing the contents of archives from their headers, without extracting
+anything.
+"""
+
+import os
+import subprocess
+import zipfile
+from typing import IO, NamedTuple, Optional
+
+from utils.extract import TarReader
+
+
+class MemberInfo(NamedTuple):
+    name: str
+    size: int
+    # None if the member isn't compressed separately, as in a tar
+    packed_size: Optional[int] = None
+    is_dir: bool = False
+
+
+def disk_usage(members: list[MemberInfo], block_size: int) -> int:
+    """
+    Estimates the disk space needed to extract `members`, with each file
+    rounded up to whole blocks and each directory taking one.
+    """
+    total = 0
+    for member in members:
+        blocks = 1 if member.is_dir else -(-member.size // block_size)
+        total += blocks * block_size
+    return total
+
+
+def index_zip(path) -> list[MemberInfo]:
+    """
+    Lists a zip archive from its central directory.
+    """
+    with zipfile.ZipFile(path) as archive:
+        return [
+            MemberInfo(info.filename, info.file_size, info.compress_size, info.is_dir())
+            for info in archive.infolist()
+        ]
+
+
+def index_tar_stream(stream: IO[bytes]) -> list[MemberInfo]:
+    """
+    Lists a tar stream from its headers. Member data is skipped, by seeking
+    if the stream allows it.
+    """
+    members = []
+    for member in TarReader(stream):
+        size = 0 if member.is_dir else member.size
+        members.append(MemberInfo(member.name, size, None, member.is_dir))
+    return members
+
+
+def _parse_7z_block(block: str) -> Optional[MemberInfo]:
+    fields = {}
+    for line in block.splitlines():
+        key, sep, value = line.partition(" = ")
+        if sep:
+            fields[key] = value
+    if "Path" not in fields:
+        return None
+    packed_size = fields.get("Packed Size")
+    return MemberInfo(
+        name=fields["Path"],
+        size=int(fields.get("Size") or 0),
+        packed_size=int(packed_size) if packed_size else None,
+        is_dir=fields.get("Folder") == "+"
+        or fields.get("Attributes", "").startswith("D"),
+    )
+
+
+def index_7z(path) -> list[MemberInfo]:
+    """
+    Lists any archive 7z can read, from the technical listing it prints
+    after reading the archive's headers.
+    """
+    result = subprocess.run(
+        ["7z", "l", "-slt", os.fspath(path)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        errors="replace",
+        check=True,
+    )
+    # Members follow a line of dashes, each as a block of "key = value"
+    # lines
+    _, _, listing = result.stdout.partition("\n----------\n")
+    members = []
+    for block in listing.split("\n\n"):
+        member = _parse_7z_block(block)
+        if member is not None:
+            members.append(member)
+    return members
+
+
+def xz_uncompressed_size(path) -> int:
+    """
+    Reads the total uncompressed size from the index of an xz file.
+    """
+    result = subprocess.run(
+        ["xz", "--robot", "--list", os.fspath(path)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        errors="replace",
+        check=True,
+    )
+    for line in result.stdout.splitlines():
+        fields = line.split("\t")
+        if fields[0] == "totals":
+            return int(fields[4])
+    raise ValueError(f"No totals in xz --list output for {os.fspath(path)!r}")
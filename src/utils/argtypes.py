@@ -0,0 +1,8 @@
+from argparse import ArgumentTypeError
+
+
+def positive_int(s):
+    value = int(s)
+    if value < 1:
+        raise ArgumentTypeError(f"must be at least 1: {s!r}")
+    return value
@@ -0,0 +1,1096 @@
+"""
+In-process archive extraction. Member paths are checked so that nothing is
+written outside the output directory, and each directory is only created
+or checked once.
+"""
+
+import bz2
+import contextlib
+import fnmatch
+import gzip
+import io
+import itertools
+import lzma
+import os
+import posixpath
+import re
+import shutil
+import stat
+import subprocess
+import threading
+import time
+import zipfile
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, IO, NamedTuple, Optional
+
+from utils.text import format_size
+from utils.ziputil import can_decompress, iter_member_data
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Allows for mtimes that don't round-trip exactly through a float
+MTIME_TOLERANCE = 0.001
+
+TAR_BLOCK_SIZE = 512
+
+# How much of each file is passed to a nested archive handler to identify
+# it
+NESTED_SNIFF_SIZE = TAR_BLOCK_SIZE
+_TAR_ZERO_BLOCK = bytes(TAR_BLOCK_SIZE)
+
+# Tar member types. GNU tar treats unknown types as regular files, but
+# they're rejected here instead.
+_TAR_REGULAR_TYPES = frozenset((b"0", b"\0", b"7"))
+_TAR_HARDLINK = b"1"
+_TAR_SYMLINK = b"2"
+_TAR_DIRECTORY = b"5"
+_TAR_PAX_HEADER = b"x"
+_TAR_PAX_GLOBAL_HEADER = b"g"
+_TAR_GNU_LONGNAME = b"L"
+_TAR_GNU_LONGLINK = b"K"
+
+_ZIP_SYSTEM_UNIX = 3
+
+_DECOMPRESSORS = (
+    (b"\x1f\x8b", gzip.open),
+    (b"BZh", bz2.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+)
+
+WarnFunction = Callable[[str], None]
+
+
+class UnsafeMemberError(Exception):
+    pass
+
+
+class ExtractError(Exception):
+    pass
+
+
+class TarFormatError(ExtractError):
+    pass
+
+
+class UnsupportedArchiveError(ExtractError):
+    pass
+
+
+class ExpansionLimitError(ExtractError):
+    pass
+
+
+class ExtractStats:
+    def __init__(self):
+        self.members = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.resumed = 0
+        self.excluded = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add(self, size: int):
+        with self._lock:
+            self.members += 1
+            self.bytes += size
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def resume(self):
+        with self._lock:
+            self.resumed += 1
+
+    def exclude(self):
+        with self._lock:
+            self.excluded += 1
+
+    def merge(self, other: "ExtractStats"):
+        """
+        Adds the counts from a nested archive's extraction.
+        """
+        with self._lock:
+            self.members += other.members
+            self.bytes += other.bytes
+            self.skipped += other.skipped
+            self.resumed += other.resumed
+            self.excluded += other.excluded
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def raise_for_skipped(self):
+        if self.skipped:
+            raise ExtractError(f"{self.skipped} members could not be extracted")
+
+    @property
+    def elapsed(self) -> float:
+        end = time.perf_counter() if self.finished is None else self.finished
+        return end - self.started
+
+    def summary(self) -> str:
+        elapsed = max(self.elapsed, 1e-6)
+        parts = [
+            f"{self.members} members, {format_size(self.bytes)}",
+            f" in {self.elapsed:.2f}s",
+            f" ({format_size(self.bytes / elapsed)}/s,",
+            f" {self.members / elapsed:.0f} members/s)",
+        ]
+        if self.resumed:
+            parts.append(f", {self.resumed} already extracted")
+        if self.excluded:
+            parts.append(f", {self.excluded} not selected")
+        if self.skipped:
+            parts.append(f", {self.skipped} skipped")
+        return "".join(parts)
+
+
+def _compile_glob(pattern: str) -> re.Pattern[str]:
+    return re.compile(fnmatch.translate(pattern.strip("/")))
+
+
+class MemberFilter:
+    """
+    Selects archive members by glob patterns, matched against their whole
+    path within the archive, where * also matches /. A member is selected
+    if it matches any of `include`, or there are none, and matches none of
+    `exclude`.
+    """
+
+    def __init__(self, include: Iterable[str] = (), exclude: Iterable[str] = ()):
+        self.include_patterns = list(include)
+        self.exclude_patterns = list(exclude)
+        self._include = [_compile_glob(p) for p in self.include_patterns]
+        self._exclude = [_compile_glob(p) for p in self.exclude_patterns]
+
+    def __bool__(self) -> bool:
+        return bool(self._include or self._exclude)
+
+    def __call__(self, name: str) -> bool:
+        name = name.strip("/")
+        if self._include and not any(p.match(name) for p in self._include):
+            return False
+        return not any(p.match(name) for p in self._exclude)
+
+
+class ExpansionLimits:
+    """
+    Limits on recursive extraction, shared by an archive and every archive
+    nested inside it, as a guard against decompression bombs. `max_depth`
+    is how many levels of nested archives may be extracted, and `max_bytes`
+    is the most that may be written in total, or None for no limit.
+    """
+
+    def __init__(self, max_depth: int = 0, max_bytes: Optional[int] = None):
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def charge(self, size: int):
+        """
+        Accounts for `size` more bytes being written, raising
+        ExpansionLimitError if that takes the total over the limit.
+        """
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            self._written += size
+            if self._written > self.max_bytes:
+                raise ExpansionLimitError(
+                    f"Expanded size is over the limit of {format_size(self.max_bytes)}"
+                )
+
+
+def safe_member_name(name: str) -> str:
+    """
+    Normalizes an archive member name to a relative path that stays within
+    the output directory. Leading slashes are removed, as tar does. Returns
+    an empty string for the root of the archive. Raises UnsafeMemberError
+    if the name would escape the output directory.
+    """
+    normalized = posixpath.normpath(name.lstrip("/"))
+    if normalized == ".":
+        return ""
+    if normalized == ".." or normalized.startswith("../"):
+        raise UnsafeMemberError(f"Path outside output directory: {name!r}")
+    return normalized
+
+
+def is_within(real_root: str, path: str) -> bool:
+    """
+    Returns True if `path`, with any symlinks already on disk resolved, is
+    `real_root` or inside it. `real_root` must itself be a real path.
+    """
+    return os.path.commonpath((real_root, os.path.realpath(path))) == real_root
+
+
+def check_link_target(root: str, name: str, link_target: str):
+    """
+    Raises UnsafeMemberError if a symlink at the member path `name` pointing
+    to `link_target` would refer outside the output directory `root`. Links
+    already extracted are followed, as a target that looks harmless can
+    still lead outside through one of them.
+    """
+    if posixpath.isabs(link_target):
+        raise UnsafeMemberError(f"Absolute link target: {name!r} -> {link_target!r}")
+    resolved = posixpath.normpath(posixpath.join(posixpath.dirname(name), link_target))
+    if (
+        resolved == ".."
+        or resolved.startswith("../")
+        or not is_within(
+            os.path.realpath(root),
+            os.path.join(root, posixpath.dirname(name), link_target),
+        )
+    ):
+        raise UnsafeMemberError(
+            f"Link target outside output directory: {name!r} -> {link_target!r}"
+        )
+
+
+def data_file_mode(mode: int) -> int:
+    """
+    Limits the permissions of an extracted file the same way as tarfile's
+    'data' filter: no special bits or group/other write, always readable
+    and writable by the owner, and only executable if the owner could
+    execute it.
+    """
+    mode &= 0o755
+    if not mode & 0o100:
+        mode &= ~0o111
+    return mode | 0o600
+
+
+class DirCache:
+    """
+    Creates directories under `root` on demand, remembering which ones are
+    known to exist as real directories so that each is only created or
+    checked once. Paths are never followed through symlinks, so nothing can
+    be written outside `root`.
+    """
+
+    def __init__(self, root):
+        self.root = os.fspath(root)
+        self._known = {""}
+
+    def ensure(self, rel_dir: str):
+        if rel_dir in self._known:
+            return
+        self.ensure(posixpath.dirname(rel_dir))
+
+        path = os.path.join(self.root, rel_dir)
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            if not stat.S_ISDIR(os.lstat(path).st_mode):
+                raise UnsafeMemberError(f"Not a directory: {rel_dir!r}")
+        self._known.add(rel_dir)
+
+    def path_for(self, name: str) -> str:
+        """
+        Returns the filesystem path for member `name`, creating its parent
+        directories.
+        """
+        self.ensure(posixpath.dirname(name))
+        return os.path.join(self.root, name)
+
+
+def open_for_write(path: str) -> int:
+    """
+    Creates a file for writing, replacing anything that isn't a directory
+    at `path`. An existing file is unlinked rather than truncated, so that
+    writing can't reach another file through a symlink or hard link.
+    """
+    remove_existing(path)
+    return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+
+
+def write_all(fd: int, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def is_complete(path: str, size: int, mtime: Optional[float]) -> bool:
+    """
+    Returns True if an earlier extraction left a regular file at `path`
+    with the given size and, unless `mtime` is None, modification time.
+    Extracted files get their mtime after all their data is written, so a
+    file that was cut off part way won't match.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    return (
+        stat.S_ISREG(st.st_mode)
+        and st.st_size == size
+        and (mtime is None or abs(st.st_mtime - mtime) < MTIME_TOLERANCE)
+    )
+
+
+def remove_existing(path: str):
+    try:
+        if not stat.S_ISDIR(os.lstat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class TarMember(NamedTuple):
+    name: str
+    type: bytes
+    mode: int
+    mtime: float
+    size: int
+    linkname: str
+
+    @property
+    def is_dir(self) -> bool:
+        return self.type == _TAR_DIRECTORY
+
+
+def _tar_string(field: bytes) -> str:
+    return field.split(b"\0", 1)[0].decode("utf-8", "surrogateescape")
+
+
+def _tar_number(field: bytes) -> int:
+    if field[0] & 0x80:
+        # GNU base-256 encoding, used for values too large for octal
+        value = int.from_bytes(field[1:], "big")
+        if field[0] & 0x40:
+            value -= 1 << (8 * (len(field) - 1))
+        return value
+    digits = field.split(b"\0", 1)[0].strip()
+    try:
+        return int(digits, 8) if digits else 0
+    except ValueError:
+        raise TarFormatError(f"Bad number in header: {field!r}")
+
+
+def _tar_checksum_ok(header: bytes) -> bool:
+    stored = _tar_number(header[148:156])
+    # The checksum field itself is summed as spaces
+    unsigned = sum(header[:148]) + 8 * 0x20 + sum(header[156:])
+    if stored == unsigned:
+        return True
+    # Some old tars summed signed bytes
+    signed = unsigned - 256 * sum(1 for byte in header if byte & 0x80)
+    return stored == signed
+
+
+def _parse_pax_records(data: bytes) -> dict[str, str]:
+    records = {}
+    offset = 0
+    while offset < len(data) and data[offset]:
+        space = data.find(b" ", offset)
+        if space < 0:
+            raise TarFormatError("Bad pax header")
+        end = offset + int(data[offset:space])
+        if end <= space or end > len(data):
+            raise TarFormatError("Bad pax header")
+        key, sep, value = data[space + 1 : end - 1].partition(b"=")
+        if not sep:
+            raise TarFormatError("Bad pax header")
+        records[key.decode("utf-8", "surrogateescape")] = value.decode(
+            "utf-8", "surrogateescape"
+        )
+        offset = end
+    return records
+
+
+def _padded_size(size: int) -> int:
+    return -(-size // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+
+
+class TarReader:
+    """
+    Reads a tar stream in a single forward pass, yielding each member's
+    header and leaving the stream positioned at its data. The caller must
+    consume the data with read_data() or skip_data() before continuing.
+
+    This handles ustar, GNU and pax headers. It's a lot less general than
+    the tarfile module, but parsing a header costs a fraction as much, which
+    matters for archives of many small files.
+    """
+
+    def __init__(self, source: IO[bytes]):
+        self.source = source
+        self._seekable = source.seekable()
+        self._remaining = 0
+        self._global_pax: dict[str, str] = {}
+
+    def _read_exact(self, size: int) -> bytes:
+        data = self.source.read(size)
+        if len(data) != size:
+            raise TarFormatError("Unexpected end of archive")
+        return data
+
+    def _read_extension(self, size: int) -> bytes:
+        return self._read_exact(_padded_size(size))[:size]
+
+    def __iter__(self) -> Iterator[TarMember]:
+        pax: dict[str, str] = {}
+        long_name: Optional[str] = None
+        long_link: Optional[str] = None
+
+        while True:
+            if self._remaining:
+                self.skip_data()
+
+            header = self.source.read(TAR_BLOCK_SIZE)
+            if not header or header == _TAR_ZERO_BLOCK:
+                return
+            if len(header) != TAR_BLOCK_SIZE:
+                raise TarFormatError("Unexpected end of archive")
+            if not _tar_checksum_ok(header):
+                raise TarFormatError("Bad header checksum")
+
+            member_type = header[156:157]
+            size = _tar_number(header[124:136])
+
+            if member_type == _TAR_PAX_HEADER:
+                pax.update(_parse_pax_records(self._read_extension(size)))
+                continue
+            if member_type == _TAR_PAX_GLOBAL_HEADER:
+                self._global_pax.update(_parse_pax_records(self._read_extension(size)))
+                continue
+            if member_type == _TAR_GNU_LONGNAME:
+                long_name = _tar_string(self._read_extension(size))
+                continue
+            if member_type == _TAR_GNU_LONGLINK:
+                long_link = _tar_string(self._read_extension(size))
+                continue
+
+            name = _tar_string(header[0:100])
+            # GNU headers have "ustar  " here, and use this field for other things
+            if header[257:265] == b"ustar\x0000":
+                prefix = _tar_string(header[345:500])
+                if prefix:
+                    name = prefix + "/" + name
+            mtime: float = _tar_number(header[136:148])
+            linkname = _tar_string(header[157:257])
+
+            if long_name is not None:
+                name = long_name
+            if long_link is not None:
+                linkname = long_link
+            overrides = {**self._global_pax, **pax}
+            if overrides:
+                name = overrides.get("path", name)
+                linkname = overrides.get("linkpath", linkname)
+                size = int(overrides.get("size", size))
+                mtime = float(overrides.get("mtime", mtime))
+                if any(key.startswith("GNU.sparse.") for key in overrides):
+                    # Sparse data has its own layout, so it can't be written
+                    # out as-is. Mark the member as unsupported.
+                    member_type = b"S"
+
+            if member_type in _TAR_REGULAR_TYPES and name.endswith("/"):
+                # Pre-POSIX tars mark directories with a trailing slash
+                member_type = _TAR_DIRECTORY
+
+            self._remaining = _padded_size(size)
+            yield TarMember(
+                name=name,
+                type=member_type,
+                mode=_tar_number(header[100:108]),
+                mtime=mtime,
+                size=size,
+                linkname=linkname,
+            )
+            pax = {}
+            long_name = long_link = None
+
+    def read_data(self, size: int) -> bytes:
+        """
+        Reads up to `size` bytes of the current member's data, including
+        block padding, which the caller should trim off the last chunk.
+        """
+        data = self._read_exact(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+    def skip_data(self):
+        if self._seekable and self._remaining:
+            self.source.seek(self._remaining, io.SEEK_CUR)
+            self._remaining = 0
+        while self._remaining:
+            self.read_data(COPY_CHUNK_SIZE)
+
+
+def is_tar_header(block: bytes) -> bool:
+    if len(block) != TAR_BLOCK_SIZE or block == _TAR_ZERO_BLOCK:
+        return False
+    try:
+        return _tar_checksum_ok(block)
+    except TarFormatError:
+        return False
+
+
+class _PrefixedRaw(io.RawIOBase):
+    def __init__(self, prefix: bytes, source: IO[bytes]):
+        self._prefix = memoryview(prefix)
+        self._source = source
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._prefix:
+            return self._source.readinto(buffer)  # type: ignore[attr-defined]
+        size = min(len(buffer), len(self._prefix))
+        buffer[:size] = self._prefix[:size]
+        self._prefix = self._prefix[size:]
+        return size
+
+
+def prefixed_reader(prefix: bytes, source: IO[bytes]) -> IO[bytes]:
+    """
+    Returns a stream that reads `prefix` followed by the rest of `source`.
+    This puts back bytes that were read to inspect a stream that can't be
+    rewound.
+    """
+    return io.BufferedReader(_PrefixedRaw(prefix, source))
+
+
+class _IteratorRaw(io.RawIOBase):
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def iterator_reader(chunks: Iterable[bytes]) -> IO[bytes]:
+    """
+    Returns a stream that reads the concatenation of `chunks`.
+    """
+    return io.BufferedReader(_IteratorRaw(iter(chunks)))
+
+
+def read_head(chunks: Iterable[bytes], size: int) -> tuple[bytes, Iterator[bytes]]:
+    """
+    Reads at least `size` bytes from the start of `chunks`, or all of them
+    if there are fewer. Returns those and an iterator over the rest.
+    """
+    chunks = iter(chunks)
+    head = []
+    head_size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        head_size += len(chunk)
+        if head_size >= size:
+            break
+    return b"".join(head), chunks
+
+
+def find_command(commands: Iterable[Sequence[str]]) -> Optional[Sequence[str]]:
+    for command in commands:
+        if shutil.which(command[0]):
+            return command
+    return None
+
+
+@contextlib.contextmanager
+def command_output(args: Sequence) -> Iterator[IO[bytes]]:
+    """
+    Runs a command and yields a stream of its stdout. Raises ExtractError on
+    exit if it fails, after reading any output that wasn't read, so that an
+    early finish doesn't make it fail on a closed pipe.
+    """
+    with subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as process:
+        assert process.stdout is not None and process.stderr is not None
+        try:
+            yield process.stdout
+            while process.stdout.read(COPY_CHUNK_SIZE):
+                pass
+        except BaseException:
+            process.kill()
+            raise
+        stderr = process.stderr.read()
+    if process.returncode:
+        message = stderr.decode(errors="replace").strip()
+        raise ExtractError(f"{args[0]} failed: {message}")
+
+
+@contextlib.contextmanager
+def command_filter(args: Sequence, source: IO[bytes]) -> Iterator[IO[bytes]]:
+    """
+    Like command_output(), but also feeds `source` to the command's stdin
+    from another thread.
+    """
+    with subprocess.Popen(
+        args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as process:
+        assert process.stdin is not None
+        assert process.stdout is not None and process.stderr is not None
+        stdin = process.stdin
+
+        def feed():
+            try:
+                shutil.copyfileobj(source, stdin, COPY_CHUNK_SIZE)
+                stdin.close()
+            except (BrokenPipeError, ValueError):
+                # The command exited, or was killed, before reading it all
+                pass
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            yield process.stdout
+            while process.stdout.read(COPY_CHUNK_SIZE):
+                pass
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            feeder.join()
+        stderr = process.stderr.read()
+    if process.returncode:
+        message = stderr.decode(errors="replace").strip()
+        raise ExtractError(f"{args[0]} failed: {message}")
+
+
+def _stdlib_decompressor(head: bytes) -> Optional[Callable[..., Any]]:
+    for magic, decompressor_open in _DECOMPRESSORS:
+        if head.startswith(magic):
+            return decompressor_open
+    return None
+
+
+@contextlib.contextmanager
+def decompress_stream(
+    source: IO[bytes], head: bytes, commands: Iterable[Sequence[str]]
+) -> Iterator[IO[bytes]]:
+    """
+    Like open_decompressed(), but for a stream that has already been
+    partly read. `head` is what was read, and `source` is the rest.
+    """
+    commands = list(commands)
+    command = find_command(commands)
+    if command is not None:
+        with command_filter(command, prefixed_reader(head, source)) as stream:
+            yield stream
+        return
+
+    opener = _stdlib_decompressor(head)
+    if opener is None:
+        raise UnsupportedArchiveError(
+            f"{commands[0][0]} not found" if commands else "Not compressed"
+        )
+    with opener(prefixed_reader(head, source), "rb") as stream:
+        yield stream
+
+
+@contextlib.contextmanager
+def open_decompressed(
+    path, commands: Iterable[Sequence[str]] = ()
+) -> Iterator[IO[bytes]]:
+    """
+    Opens a file for reading, decompressing it if it's compressed.
+
+    The first of `commands` that is installed is run with `path` as its last
+    argument, and its stdout is read. This is how decompressors that run on
+    several threads, or that the standard library doesn't have, are used.
+    Otherwise, gzip, bzip2 and xz are decompressed in-process, and anything
+    else is read as-is. Raises UnsupportedArchiveError if `commands` is
+    given but none are installed and the format isn't one of those.
+    """
+    commands = list(commands)
+    command = find_command(commands)
+    if command is not None:
+        with command_output([*command, os.fspath(path)]) as stream:
+            yield stream
+        return
+
+    with open(path, "rb") as reader:
+        head = reader.read(6)
+    opener = _stdlib_decompressor(head)
+    if opener is None:
+        if commands:
+            raise UnsupportedArchiveError(f"{commands[0][0]} not found")
+        opener = open
+
+    with opener(path, "rb") as stream:
+        yield stream
+
+
+class Extractor:
+    """
+    Common state for extracting one archive into `out_dir`.
+
+    If `resume` is true, files left complete by an earlier extraction into
+    the same directory are kept rather than extracted again. If `select`
+    is given, only members whose names it returns true for are extracted.
+
+    If `nested` is given, it's called with the first bytes of each file.
+    If it returns a function, the file is an archive that should be
+    extracted recursively. The function is called with a stream of the
+    file's contents and the path the file would have been written to, and
+    returns the stats of extracting it.
+    """
+
+    def __init__(
+        self,
+        out_dir,
+        warn: WarnFunction,
+        nested: Optional["NestedHandler"] = None,
+        limits: Optional[ExpansionLimits] = None,
+        resume: bool = False,
+        select: Optional[Callable[[str], bool]] = None,
+    ):
+        self.dirs = DirCache(out_dir)
+        self.warn = warn
+        self.nested = nested
+        self.limits = ExpansionLimits() if limits is None else limits
+        self.resume = resume
+        self.select = select
+        self.stats = ExtractStats()
+        self._dir_attrs: list[tuple[str, int, float]] = []
+
+    def skip_member(self, name: str, error: Exception):
+        self.stats.skip()
+        self.warn(f"{name!r}: {error}")
+
+    def write_file(
+        self,
+        path: str,
+        chunks: Iterable[bytes],
+        mode: int,
+        mtime: Optional[float],
+        size: Optional[int] = None,
+    ):
+        """
+        Writes a member's contents to `path`, or if it's a nested archive,
+        extracts it instead. `size` is the member's size if it's known in
+        advance. When resuming, a file that's already complete is left
+        alone and `chunks` isn't read at all.
+        """
+        if self.is_resumable(path, size, mtime):
+            self.stats.resume()
+            return
+
+        if self.nested is not None:
+            head, rest = read_head(chunks, NESTED_SNIFF_SIZE)
+            extract_nested = self.nested(head)
+            if extract_nested is not None:
+                stream = prefixed_reader(head, iterator_reader(rest))
+                try:
+                    self.stats.merge(extract_nested(stream, path))
+                except ExpansionLimitError:
+                    raise
+                except Exception as nested_error:
+                    # A broken nested archive is a broken member, not a
+                    # broken outer archive
+                    name = os.path.relpath(path, self.dirs.root)
+                    self.skip_member(name, nested_error)
+                return
+            chunks = itertools.chain((head,), rest)
+
+        size = 0
+        fd = open_for_write(path)
+        try:
+            for chunk in chunks:
+                self.limits.charge(len(chunk))
+                write_all(fd, chunk)
+                size += len(chunk)
+            os.fchmod(fd, data_file_mode(mode))
+            if mtime is not None:
+                os.utime(fd, (mtime, mtime))
+        finally:
+            os.close(fd)
+        self.stats.add(size)
+
+    def is_selected(self, name: str) -> bool:
+        if self.select is None or self.select(name):
+            return True
+        self.stats.exclude()
+        return False
+
+    def is_resumable(
+        self, path: str, size: Optional[int], mtime: Optional[float]
+    ) -> bool:
+        return (
+            self.resume
+            and size is not None
+            and mtime is not None
+            and is_complete(path, size, mtime)
+        )
+
+    def add_dir(self, name: str, mode: int, mtime: float):
+        self.dirs.ensure(name)
+        if name:
+            path = os.path.join(self.dirs.root, name)
+            self._dir_attrs.append((path, (mode & 0o755) | 0o700, mtime))
+        self.stats.add(0)
+
+    def add_symlink(self, name: str, link_target: str):
+        check_link_target(self.dirs.root, name, link_target)
+        path = self.dirs.path_for(name)
+        remove_existing(path)
+        os.symlink(link_target, path)
+        self.stats.add(0)
+
+    def finish(self) -> ExtractStats:
+        # Directory times are set last, as extracting their contents
+        # changes them. Deepest first, so parents aren't touched again.
+        for path, mode, mtime in reversed(self._dir_attrs):
+            try:
+                os.chmod(path, mode)
+                os.utime(path, (mtime, mtime))
+            except (OSError, OverflowError, ValueError) as attr_error:
+                self.warn(f"{path!r}: {attr_error}")
+
+        self.stats.finish()
+        return self.stats
+
+
+# Problems confined to one member. os.utime() raises OverflowError or
+# ValueError for times the platform can't represent.
+_MEMBER_ERRORS = (UnsafeMemberError, OSError, OverflowError, ValueError)
+
+
+class TarExtractor(Extractor):
+    """
+    Extracts a tar stream in a single forward pass. The source doesn't need
+    to be seekable.
+    """
+
+    def extract_fileobj(self, fileobj: IO[bytes]) -> ExtractStats:
+        reader = TarReader(fileobj)
+        for member in reader:
+            try:
+                self._extract_member(reader, member)
+            except _MEMBER_ERRORS as member_error:
+                self.skip_member(member.name, member_error)
+        return self.finish()
+
+    def extract_file(
+        self, path, commands: Iterable[Sequence[str]] = ()
+    ) -> ExtractStats:
+        with open_decompressed(path, commands) as reader:
+            return self.extract_fileobj(reader)
+
+    def _extract_member(self, reader: TarReader, member: TarMember):
+        name = safe_member_name(member.name)
+        if not self.is_selected(name):
+            # Its data is skipped by TarReader, by seeking if it can
+            return
+
+        if member.is_dir:
+            self.add_dir(name, member.mode, member.mtime)
+            return
+
+        if not name:
+            raise UnsafeMemberError("Non-directory at archive root")
+
+        if member.type in _TAR_REGULAR_TYPES:
+            self._extract_file(reader, member, self.dirs.path_for(name))
+        elif member.type == _TAR_SYMLINK:
+            self.add_symlink(name, member.linkname)
+        elif member.type == _TAR_HARDLINK:
+            # The source's directories are resolved, but not the source
+            # itself, as a hard link to a symlink links the symlink
+            source_dir, source_name = os.path.split(
+                os.path.join(self.dirs.root, safe_member_name(member.linkname))
+            )
+            source_path = os.path.join(os.path.realpath(source_dir), source_name)
+            if not is_within(os.path.realpath(self.dirs.root), source_dir):
+                raise UnsafeMemberError(
+                    f"Link source outside output directory: {member.linkname!r}"
+                )
+            path = self.dirs.path_for(name)
+            remove_existing(path)
+            os.link(source_path, path, follow_symlinks=False)
+            self.stats.add(0)
+        else:
+            raise UnsafeMemberError(f"Unsupported member type {member.type!r}")
+
+    def _extract_file(self, reader: TarReader, member: TarMember, path):
+        # When resuming, data that isn't read is skipped by TarReader
+        self.write_file(
+            path,
+            _iter_tar_data(reader, member.size),
+            member.mode,
+            member.mtime,
+            member.size,
+        )
+
+
+def _iter_tar_data(reader: TarReader, size: int) -> Iterator[bytes]:
+    remaining = size
+    while remaining > 0:
+        chunk = reader.read_data(COPY_CHUNK_SIZE)
+        yield chunk[:remaining] if len(chunk) > remaining else chunk
+        remaining -= len(chunk)
+
+
+def zip_member_mode(info: zipfile.ZipInfo) -> int:
+    """
+    Returns the Unix mode of a zip member, or 0 if it wasn't recorded.
+    """
+    return info.external_attr >> 16 if info.create_system == _ZIP_SYSTEM_UNIX else 0
+
+
+def zip_member_mtime(info: zipfile.ZipInfo) -> float:
+    # Zip timestamps are in local time
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+class ZipExtractor(Extractor):
+    """
+    Extracts a zip archive, decompressing members concurrently. Members are
+    compressed independently of each other, and zlib and bz2 release the
+    GIL, so this scales with the number of threads.
+    """
+
+    def __init__(
+        self,
+        out_dir,
+        warn: WarnFunction,
+        nested: Optional["NestedHandler"] = None,
+        limits: Optional[ExpansionLimits] = None,
+        resume: bool = False,
+        select: Optional[Callable[[str], bool]] = None,
+        jobs: Optional[int] = None,
+    ):
+        super().__init__(out_dir, warn, nested, limits, resume, select)
+        self.jobs = jobs
+
+    def extract_file(self, path) -> ExtractStats:
+        """
+        Extracts the zip archive at `path`. Raises UnsupportedArchiveError
+        before anything is written if any member is encrypted or uses a
+        compression method that can't be read.
+        """
+        return self._extract(lambda: open(path, "rb"))
+
+    def extract_data(self, data: bytes) -> ExtractStats:
+        """
+        Like extract_file(), for an archive that's in memory.
+        """
+        return self._extract(lambda: io.BytesIO(data))
+
+    def _extract(self, open_source: Callable[[], IO[bytes]]) -> ExtractStats:
+        with zipfile.ZipFile(open_source()) as archive:
+            infos = archive.infolist()
+        for info in infos:
+            if not can_decompress(info):
+                raise UnsupportedArchiveError(f"Can't decompress {info.filename!r}")
+
+        # Later members replace earlier ones with the same name
+        # Unselected members are dropped here, so their data is never read
+        members: dict[str, zipfile.ZipInfo] = {}
+        for info in infos:
+            try:
+                name = safe_member_name(info.filename)
+            except UnsafeMemberError as name_error:
+                self.skip_member(info.filename, name_error)
+                continue
+            if self.is_selected(name):
+                members[name] = info
+
+        # Directories are created up front, so that the worker threads only
+        # write files, and symlinks are made last, so that none of the
+        # files can be written through one
+        files = []
+        symlinks = []
+        for name, info in members.items():
+            try:
+                if info.is_dir():
+                    self.add_dir(
+                        name, zip_member_mode(info) or 0o755, zip_member_mtime(info)
+                    )
+                elif not name:
+                    raise UnsafeMemberError("Non-directory at archive root")
+                elif stat.S_ISLNK(zip_member_mode(info)):
+                    symlinks.append((name, info))
+                else:
+                    member_path = self.dirs.path_for(name)
+                    # Complete members are skipped here, so that their data
+                    # isn't even read
+                    mtime = zip_member_mtime(info)
+                    if self.is_resumable(member_path, info.file_size, mtime):
+                        self.stats.resume()
+                    else:
+                        files.append((name, info, member_path))
+            except (UnsafeMemberError, OSError) as member_error:
+                self.skip_member(info.filename, member_error)
+
+        with ThreadPoolExecutor(self.jobs) as executor:
+            futures = [
+                (
+                    info,
+                    executor.submit(self._extract_file, open_source, info, member_path),
+                )
+                for _, info, member_path in files
+            ]
+            try:
+                for info, future in futures:
+                    try:
+                        future.result()
+                    except (
+                        UnsafeMemberError,
+                        zipfile.BadZipFile,
+                        OSError,
+                    ) as member_error:
+                        self.skip_member(info.filename, member_error)
+            except BaseException:
+                # Something like ExpansionLimitError ends the whole archive
+                executor.shutdown(cancel_futures=True)
+                raise
+
+        with open_source() as source:
+            for name, info in symlinks:
+                try:
+                    target = b"".join(iter_member_data(source, info))
+                    self.add_symlink(name, os.fsdecode(target))
+                except (UnsafeMemberError, zipfile.BadZipFile, OSError) as link_error:
+                    self.skip_member(info.filename, link_error)
+
+        return self.finish()
+
+    def _extract_file(
+        self,
+        open_source: Callable[[], IO[bytes]],
+        info: zipfile.ZipInfo,
+        path: str,
+    ):
+        # Each member gets its own file object, so threads don't contend
+        # over a shared file position
+        with open_source() as source:
+            self.write_file(
+                path,
+                iter_member_data(source, info),
+                zip_member_mode(info) or 0o644,
+                zip_member_mtime(info),
+            )
+
+
+NestedExtractFunction = Callable[[IO[bytes], str], ExtractStats]
+NestedHandler = Callable[[bytes], Optional[NestedExtractFunction]]
@@ -0,0 +1,257 @@
+"""
+Format sniffing and in-process lossless recompression of PNG and GIF files
+using Pillow. Every encoding is decoded again and compared against the
+original pixels, so a variant is only reported as valid if it is lossless.
+"""
+
+import enum
+import io
+import struct
+import sys
+import zlib
+from collections.abc import Callable, Iterator
+from functools import partial
+from typing import Any, NamedTuple, Optional
+
+import PIL.Image
+from PIL.PngImagePlugin import PngInfo
+
+
+class ImageFormat(enum.Enum):
+    GIF = enum.auto()
+    JPEG = enum.auto()
+    PNG = enum.auto()
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_IEND_CHUNK = b"\x00\x00\x00\x00IEND\xae\x42\x60\x82"
+GIF_TRAILER = b"\x3b"
+
+_SIGNATURES = (
+    # Start of Image, followed by the first byte of the next marker
+    (b"\xff\xd8\xff", ImageFormat.JPEG),
+    (PNG_SIGNATURE, ImageFormat.PNG),
+    (b"GIF87a", ImageFormat.GIF),
+    (b"GIF89a", ImageFormat.GIF),
+)
+SNIFF_SIZE = max(len(signature) for signature, _ in _SIGNATURES)
+
+PNG_ZLIB_STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "rle": zlib.Z_RLE,
+}
+
+# Ancillary chunks that Pillow will rewrite itself from image.info or the
+# encoder arguments
+_PNG_REGENERATED_CHUNKS = frozenset((b"tRNS", b"iCCP", b"pHYs", b"eXIf"))
+
+# Ancillary chunks whose contents depend on the color type, so they can't be
+# carried over if that changes
+_PNG_COLOR_TYPE_CHUNKS = frozenset((b"sBIT", b"bKGD", b"hIST"))
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+class Encoding(NamedTuple):
+    name: str
+    data: bytes
+    valid: bool
+
+
+def sniff_format(head: bytes) -> Optional[ImageFormat]:
+    for signature, image_format in _SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def sniff_file_format(path) -> Optional[ImageFormat]:
+    with open(path, "rb") as reader:
+        return sniff_format(reader.read(SNIFF_SIZE))
+
+
+def is_complete_image(data: bytes, image_format: ImageFormat) -> bool:
+    """
+    A cheap check that `data` has the signature and trailer of the given
+    format, to catch truncated output.
+    """
+    if sniff_format(data) is not image_format:
+        return False
+    if image_format is ImageFormat.PNG:
+        return data.endswith(PNG_IEND_CHUNK)
+    if image_format is ImageFormat.GIF:
+        return data.endswith(GIF_TRAILER)
+    return data.endswith(b"\xff\xd9")
+
+
+def iter_png_chunks(data: bytes) -> Iterator[tuple[bytes, bytes]]:
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(data):
+        length, cid = struct.unpack_from(">L4s", data, offset)
+        yield cid, data[offset + 8 : offset + 8 + length]
+        offset += 12 + length
+
+
+def pixel_bytes(image: PIL.Image.Image) -> bytes:
+    return image.convert("RGBA").tobytes()
+
+
+def pixels_match(reference: bytes, data: bytes) -> bool:
+    with PIL.Image.open(io.BytesIO(data)) as image:
+        return pixel_bytes(image) == reference
+
+
+def to_exact_palette(image: PIL.Image.Image) -> Optional[PIL.Image.Image]:
+    """
+    Converts an RGB or RGBA image to a palette image with exactly the same
+    pixels, or returns None if it has more than 256 colors.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        return None
+
+    rgba = image.convert("RGBA")
+    colors = rgba.getcolors(256)
+    if colors is None:
+        return None
+
+    palette = [color for _, color in colors]
+    # Pack each RGBA pixel into a native int, so the whole image can be
+    # mapped to palette indices with one pass over a memoryview
+    index = {
+        int.from_bytes(bytes(color), sys.byteorder): i
+        for i, color in enumerate(palette)
+    }
+    pixels = memoryview(rgba.tobytes()).cast("I")
+    indices = bytes(map(index.__getitem__, pixels))
+
+    palette_image = PIL.Image.frombytes("P", rgba.size, indices)
+    palette_image.putpalette(
+        [channel for color in palette for channel in color[:3]], "RGB"
+    )
+    alpha = bytes(color[3] for color in palette)
+    if alpha.rstrip(b"\xff"):
+        palette_image.info["transparency"] = alpha
+    return palette_image
+
+
+def _png_copied_chunks(data: bytes, same_color_type: bool) -> PngInfo:
+    pnginfo = PngInfo()
+    for cid, chunk_data in iter_png_chunks(data):
+        is_ancillary = cid[0:1].islower()
+        if (
+            not is_ancillary
+            or cid in _PNG_REGENERATED_CHUNKS
+            or (cid in _PNG_COLOR_TYPE_CHUNKS and not same_color_type)
+        ):
+            continue
+        pnginfo.add(cid, chunk_data)
+    return pnginfo
+
+
+def _encode_png(
+    image: PIL.Image.Image,
+    source: PIL.Image.Image,
+    pnginfo: PngInfo,
+    zlib_strategy: int,
+    name: str,
+    reference: bytes,
+) -> Encoding:
+    save_args: dict[str, Any] = dict(
+        format="PNG",
+        optimize=True,
+        compress_level=9,
+        compress_type=zlib_strategy,
+        pnginfo=pnginfo,
+    )
+    for key in ("icc_profile", "dpi", "exif"):
+        if key in source.info:
+            save_args[key] = source.info[key]
+
+    # Saving sets attributes on the image, so each encoder needs its own
+    writer = io.BytesIO()
+    image.copy().save(writer, **save_args)
+    data = writer.getvalue()
+    return Encoding(name, data, pixels_match(reference, data))
+
+
+def _encode_gif(
+    image: PIL.Image.Image,
+    interlace: bool,
+    name: str,
+    reference: bytes,
+) -> Encoding:
+    writer = io.BytesIO()
+    image.copy().save(writer, format="GIF", optimize=True, interlace=interlace)
+    data = writer.getvalue()
+    return Encoding(name, data, pixels_match(reference, data))
+
+
+def png_encoders(data: bytes) -> list[Callable[[], Encoding]]:
+    chunks = dict(iter_png_chunks(data))
+    ihdr = chunks.get(b"IHDR", b"")
+    if len(ihdr) < 9:
+        raise UnsupportedImage("missing IHDR")
+    if ihdr[8] > 8:
+        # Pillow reduces 16-bit color to 8 bits on load
+        raise UnsupportedImage("16-bit PNG")
+    if b"acTL" in chunks:
+        raise UnsupportedImage("animated PNG")
+
+    image = PIL.Image.open(io.BytesIO(data))
+    image.load()
+    reference = pixel_bytes(image)
+
+    variants: list[tuple[str, PIL.Image.Image, bool]] = [("", image, True)]
+    palette_image = to_exact_palette(image)
+    if palette_image is not None:
+        variants.append(("palette", palette_image, False))
+
+    encoders: list[Callable[[], Encoding]] = []
+    for variant_name, variant, same_color_type in variants:
+        pnginfo = _png_copied_chunks(data, same_color_type)
+        for strategy_name, zlib_strategy in PNG_ZLIB_STRATEGIES.items():
+            name = "-".join(filter(None, (variant_name, strategy_name)))
+            encoders.append(
+                partial(
+                    _encode_png,
+                    variant,
+                    image,
+                    pnginfo,
+                    zlib_strategy,
+                    name,
+                    reference,
+                )
+            )
+    return encoders
+
+
+def gif_encoders(data: bytes) -> list[Callable[[], Encoding]]:
+    image = PIL.Image.open(io.BytesIO(data))
+    if getattr(image, "n_frames", 1) > 1:
+        raise UnsupportedImage("animated GIF")
+    image.load()
+    reference = pixel_bytes(image)
+
+    return [
+        partial(_encode_gif, image, interlace, name, reference)
+        for name, interlace in (("progressive", True), ("sequential", False))
+    ]
+
+
+def pillow_encoders(
+    data: bytes, image_format: ImageFormat
+) -> list[Callable[[], Encoding]]:
+    """
+    Returns a list of callables, each of which encodes one lossless variant
+    of the PNG or GIF file `data`. They are independent of each other and
+    can be run concurrently. Raises UnsupportedImage for images that can't
+    be round-tripped through Pillow without loss.
+    """
+    if image_format is ImageFormat.PNG:
+        return png_encoders(data)
+    if image_format is ImageFormat.GIF:
+        return gif_encoders(data)
+    raise UnsupportedImage(f"no in-process encoder for {image_format.name}")
@@ -1,6 +1,7 @@
+import plistlib
 import re
 import subprocess
-from functools import lru_cache
+from collections.abc import Iterable
 from typing import Optional
 
 MDFIND = "/usr/bin/mdfind"
@@ -10,10 +11,17 @@ class BundleError(Exception):
     pass
 
 
-def find_all_apps_by_bundle_id(bundle_id: str) -> list[str]:
+# Results of earlier queries, by bundle id
+_apps_by_bundle_id: dict[str, list[str]] = {}
+
+
+def _bundle_id_clause(bundle_id: str) -> str:
     escaped = re.sub(r"[\x22\x27\x2A\x3F\x5C]", r"\\\g<0>", bundle_id)
     quoted = f'"{escaped}"'
-    query = f"kMDItemCFBundleIdentifier={quoted}"
+    return f"kMDItemCFBundleIdentifier={quoted}"
+
+
+def _mdfind(query: str) -> list[str]:
     args = [MDFIND, "-0", query]
     proc_result = subprocess.run(
         args,
@@ -25,7 +33,52 @@ def find_all_apps_by_bundle_id(bundle_id: str) -> list[str]:
     return [match for match in proc_result.stdout.split("\x00") if len(match) > 0]
 
 
-@lru_cache(maxsize=128)
+def read_bundle_id(app_path: str) -> Optional[str]:
+    try:
+        with open(f"{app_path}/Contents/Info.plist", "rb") as reader:
+            bundle_id = plistlib.load(reader).get("CFBundleIdentifier")
+    except (OSError, plistlib.InvalidFileException, ValueError):
+        return None
+    return bundle_id if isinstance(bundle_id, str) else None
+
+
+def prefetch_bundle_ids(bundle_ids: Iterable[str]):
+    """
+    Looks up several bundle ids with a single Spotlight query, so that
+    later calls to find_app_by_bundle_id() for them don't each run mdfind.
+    Each app found is matched back to its bundle id by reading its
+    Info.plist. Ids that can't be settled that way, or at all if the query
+    fails, are left to be looked up one at a time.
+    """
+    wanted = {bundle_id for bundle_id in bundle_ids} - _apps_by_bundle_id.keys()
+    if not wanted:
+        return
+
+    query = " || ".join(_bundle_id_clause(bundle_id) for bundle_id in sorted(wanted))
+    try:
+        paths = _mdfind(query)
+    except (OSError, subprocess.CalledProcessError):
+        return
+
+    found: dict[str, list[str]] = {bundle_id: [] for bundle_id in wanted}
+    for path in paths:
+        bundle_id = read_bundle_id(path)
+        if bundle_id in found:
+            found[bundle_id].append(path)
+        else:
+            # Can't tell which id it was found for, so none are trusted
+            return
+    _apps_by_bundle_id.update(found)
+
+
+def find_all_apps_by_bundle_id(bundle_id: str) -> list[str]:
+    paths = _apps_by_bundle_id.get(bundle_id)
+    if paths is None:
+        paths = _mdfind(_bundle_id_clause(bundle_id))
+        _apps_by_bundle_id[bundle_id] = paths
+    return list(paths)
+
+
 def find_app_by_bundle_id(bundle_id: str) -> Optional[str]:
     paths = find_all_apps_by_bundle_id(bundle_id)
     if len(paths) == 0:
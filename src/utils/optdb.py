@@ -0,0 +1,157 @@
+import hashlib
+import os
+import sqlite3
+from collections.abc import Iterable
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+OUTCOME_OPTIMIZED = "optimized"
+OUTCOME_INCOMPRESSIBLE = "incompressible"
+
+# Paths are stored as BLOBs of their filesystem encoding, as names that
+# aren't valid UTF-8 can't be bound as TEXT
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS files (
+    path BLOB PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    strategies TEXT NOT NULL DEFAULT ''
+)
+"""
+
+_FILE_COLUMNS = "path, size, mtime_ns, hash, outcome, strategies"
+
+
+class FileRecord(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    hash: str
+    outcome: str
+    # The optimizer settings the file was processed with
+    strategies: frozenset[str] = frozenset()
+
+
+def hash_file(path) -> str:
+    digest = hashlib.blake2b()
+    with open(path, "rb") as reader:
+        while chunk := reader.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def record_file(path, outcome: str, strategies: Iterable[str] = ()) -> FileRecord:
+    """
+    Creates a FileRecord describing the current state of the file at `path`,
+    after processing with `strategies`.
+    """
+    real_path = os.path.realpath(path)
+    stat = os.stat(real_path)
+    return FileRecord(
+        path=real_path,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        hash=hash_file(real_path),
+        outcome=outcome,
+        strategies=frozenset(strategies),
+    )
+
+
+class OptimizedDB:
+    """
+    A SQLite database of files that have already been through an optimizer,
+    so that unchanged files can be skipped on later runs.
+
+    Files are keyed on their real path. A file is considered unchanged if its
+    size and mtime match the stored record, or failing that, if its size and
+    content hash do, and it was processed with at least the strategies now
+    being asked for. Records from before strategies were stored have none,
+    so those files are processed again.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        # WAL with synchronous=NORMAL makes each per-file commit cheap
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if "strategies" not in columns:
+            with self._conn:
+                self._conn.execute(
+                    "ALTER TABLE files ADD COLUMN strategies TEXT NOT NULL DEFAULT ''"
+                )
+        (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+        if version < 1:
+            # Paths were TEXT, which is the same bytes for those that could
+            # be stored at all
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE files SET path = CAST(path AS BLOB)"
+                    " WHERE typeof(path) = 'text'"
+                )
+            self._conn.execute("PRAGMA user_version = 1")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def get(self, path) -> Optional[FileRecord]:
+        row = self._conn.execute(
+            f"SELECT {_FILE_COLUMNS} FROM files WHERE path = ?",
+            (os.fsencode(os.path.realpath(path)),),
+        ).fetchone()
+        if row is None:
+            return None
+        strategies = frozenset(row[-1].split(",")) - {""}
+        return FileRecord(*row)._replace(
+            path=os.fsdecode(row[0]), strategies=strategies
+        )
+
+    def put(self, record: FileRecord):
+        with self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO files ({_FILE_COLUMNS})"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    os.fsencode(record.path),
+                    *record[1:-1],
+                    ",".join(sorted(record.strategies)),
+                ),
+            )
+
+    def is_unchanged(self, path, strategies: Iterable[str] = ()) -> bool:
+        """
+        Returns True if the file at `path` is known to have already been
+        processed in its current state, with every one of `strategies`.
+        """
+        record = self.get(path)
+        if record is None or not record.strategies.issuperset(strategies):
+            return False
+
+        try:
+            stat = os.stat(record.path)
+            if stat.st_size != record.size:
+                return False
+            if stat.st_mtime_ns == record.mtime_ns:
+                return True
+
+            # Touched, but possibly not modified
+            if hash_file(record.path) != record.hash:
+                return False
+        except OSError:
+            return False
+
+        self.put(record._replace(mtime_ns=stat.st_mtime_ns))
+        return True
@@ -19,3 +19,11 @@ def significant_lines(text: str) -> list[str]:
 
 def text_is_pretty_much_same(a: str, b: str) -> bool:
     return significant_lines(a) == significant_lines(b)
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if abs(size) < 1024 or unit == "TiB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
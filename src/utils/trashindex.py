@@ -0,0 +1,199 @@
+import os
+import sqlite3
+from collections.abc import Iterable
+from pathlib import Path
+from typing import NamedTuple
+
+from utils.xdgtrash import TrashDirectory, TRASHINFO_SUFFIX
+
+# Bumped when the schema changes. The index is only a cache, so an older
+# one is simply rebuilt.
+_SCHEMA_VERSION = 1
+
+# Paths and names are stored as BLOBs of their filesystem encoding, as
+# names that aren't valid UTF-8 can't be bound as TEXT
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS dirs (
+    path BLOB PRIMARY KEY,
+    info_mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    trash_dir BLOB NOT NULL,
+    name BLOB NOT NULL,
+    original_path BLOB NOT NULL,
+    deleted TEXT NOT NULL,
+    info_mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (trash_dir, name)
+);
+CREATE INDEX IF NOT EXISTS entries_by_original
+    ON entries (original_path, deleted);
+CREATE INDEX IF NOT EXISTS entries_by_deleted
+    ON entries (deleted);
+"""
+
+_ENTRY_COLUMNS = "trash_dir, name, original_path, deleted"
+
+
+class TrashEntry(NamedTuple):
+    trash_dir: str
+    name: str
+    original_path: str
+    deleted: str
+
+
+class TrashIndex:
+    """
+    A SQLite index of the entries in one or more trash directories, keyed on
+    their original path and deletion date, so that they can be looked up
+    without reading every .trashinfo file.
+
+    sync() brings it up to date. A trash directory is only looked at again
+    if the modification time of its info directory has changed, and then
+    only the info files that have appeared or changed since are read.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+        if version != _SCHEMA_VERSION:
+            with self._conn:
+                self._conn.execute("DROP TABLE IF EXISTS entries")
+                self._conn.execute("DROP TABLE IF EXISTS dirs")
+            self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def sync(self, trash_dirs: Iterable[TrashDirectory]):
+        """
+        Updates the index to match `trash_dirs`. Entries from any other
+        trash directory, such as one on a drive that's since been
+        unmounted, are dropped.
+        """
+        trash_dirs = list(trash_dirs)
+        with self._conn:
+            known = {os.fsencode(trash_dir.path) for trash_dir in trash_dirs}
+            for (path,) in self._conn.execute("SELECT path FROM dirs").fetchall():
+                if path not in known:
+                    self._forget_dir(path)
+            for trash_dir in trash_dirs:
+                self._sync_dir(trash_dir)
+
+    def _forget_dir(self, path: bytes):
+        self._conn.execute("DELETE FROM entries WHERE trash_dir = ?", (path,))
+        self._conn.execute("DELETE FROM dirs WHERE path = ?", (path,))
+
+    def _sync_dir(self, trash_dir: TrashDirectory):
+        dir_key = os.fsencode(trash_dir.path)
+        try:
+            mtime_ns = os.stat(trash_dir.info_dir).st_mtime_ns
+        except FileNotFoundError:
+            self._forget_dir(dir_key)
+            return
+
+        row = self._conn.execute(
+            "SELECT info_mtime_ns FROM dirs WHERE path = ?", (dir_key,)
+        ).fetchone()
+        if row is not None and row[0] == mtime_ns:
+            return
+
+        # A name can be reused after its entry is removed, so info files are
+        # told apart by their mtimes as well
+        info_mtimes = {}
+        for entry in os.scandir(trash_dir.info_dir):
+            if entry.name.endswith(TRASHINFO_SUFFIX):
+                try:
+                    mtime = entry.stat(follow_symlinks=False).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                info_mtimes[entry.name[: -len(TRASHINFO_SUFFIX)]] = mtime
+        indexed = {
+            os.fsdecode(name): mtime
+            for name, mtime in self._conn.execute(
+                "SELECT name, info_mtime_ns FROM entries WHERE trash_dir = ?",
+                (dir_key,),
+            )
+        }
+
+        self._conn.executemany(
+            "DELETE FROM entries WHERE trash_dir = ? AND name = ?",
+            (
+                (dir_key, os.fsencode(name))
+                for name in indexed.keys() - info_mtimes.keys()
+            ),
+        )
+        for name, info_mtime in info_mtimes.items():
+            if indexed.get(name) == info_mtime:
+                continue
+            try:
+                original, deleted = trash_dir.read_info(name)
+            except (OSError, ValueError):
+                # Unreadable, or removed since it was listed. If it's still
+                # there, it's tried again the next time the directory changes.
+                continue
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (
+                    dir_key,
+                    os.fsencode(name),
+                    os.fsencode(original),
+                    deleted,
+                    info_mtime,
+                ),
+            )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dirs VALUES (?, ?)", (dir_key, mtime_ns)
+        )
+
+    def all(self) -> list[TrashEntry]:
+        return self._query("1", ())
+
+    def matching(self, pattern: str) -> list[TrashEntry]:
+        """
+        Returns entries whose original path matches the glob `pattern`, or
+        if it has no /, whose original name does.
+        """
+        if "/" not in pattern:
+            pattern = "*/" + pattern
+        # GLOB doesn't match BLOBs, but their bytes can be read as TEXT
+        return self._query(
+            "CAST(original_path AS TEXT) GLOB CAST(? AS TEXT)",
+            (os.fsencode(pattern),),
+        )
+
+    def deleted_before(self, date: str) -> list[TrashEntry]:
+        return self._query("deleted < ?", (date,))
+
+    def remove(self, entry: TrashEntry):
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM entries WHERE trash_dir = ? AND name = ?",
+                (os.fsencode(entry.trash_dir), os.fsencode(entry.name)),
+            )
+
+    def _query(self, where: str, params: tuple) -> list[TrashEntry]:
+        rows = self._conn.execute(
+            f"SELECT {_ENTRY_COLUMNS} FROM entries WHERE {where}"
+            " ORDER BY deleted, original_path",
+            params,
+        )
+        return [
+            TrashEntry(
+                os.fsdecode(trash_dir),
+                os.fsdecode(name),
+                os.fsdecode(original),
+                deleted,
+            )
+            for trash_dir, name, original, deleted in rows
+        ]
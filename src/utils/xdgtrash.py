@@ -0,0 +1,394 @@
+"""
+Moving files to the Trash as described by the freedesktop.org Trash
+specification, https://specifications.freedesktop.org/trash-spec/
+
+Files are only ever renamed into a trash directory on their own device,
+never copied, so trashing is quick regardless of size.
+"""
+
+import errno
+import os
+import re
+import shutil
+import stat
+import tempfile
+import time
+import urllib.parse
+from typing import NamedTuple, Optional
+
+TRASHINFO_SUFFIX = ".trashinfo"
+TRASHINFO_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+DIRECTORY_SIZES_NAME = "directorysizes"
+
+
+class DirectorySize(NamedTuple):
+    size: int
+    # Of the directory's .trashinfo file, in whole seconds. The entry is
+    # only valid while this matches.
+    info_mtime: int
+
+
+def xdg_data_home() -> str:
+    data_home = os.environ.get("XDG_DATA_HOME")
+    # The spec says relative paths are invalid and should be ignored
+    if data_home and os.path.isabs(data_home):
+        return data_home
+    return os.path.join(os.path.expanduser("~"), ".local", "share")
+
+
+def xdg_cache_home() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if cache_home and os.path.isabs(cache_home):
+        return cache_home
+    return os.path.join(os.path.expanduser("~"), ".cache")
+
+
+def mount_points() -> list[str]:
+    """
+    Returns the mount points listed in /proc/self/mounts, or an empty list
+    where that isn't available.
+    """
+    try:
+        with open(
+            "/proc/self/mounts", encoding="utf-8", errors="surrogateescape"
+        ) as mounts:
+            lines = mounts.readlines()
+    except OSError:
+        return []
+    # Spaces and other awkward characters are escaped as octal
+    return [
+        re.sub(r"\\([0-7]{3})", lambda m: chr(int(m[1], 8)), line.split()[1])
+        for line in lines
+        if len(line.split()) > 1
+    ]
+
+
+def find_mount_point(path: str) -> str:
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def trashinfo_text(original_path: str, deletion_time: float) -> str:
+    quoted_path = urllib.parse.quote(os.fsencode(original_path), safe="/")
+    date = time.strftime(TRASHINFO_DATE_FORMAT, time.localtime(deletion_time))
+    return f"[Trash Info]\nPath={quoted_path}\nDeletionDate={date}\n"
+
+
+def parse_trashinfo(text: str) -> tuple[str, str]:
+    """
+    Returns the original path and deletion date recorded in the contents of
+    a .trashinfo file. The path is as written, so it may be relative to the
+    trash directory's topdir.
+    """
+    fields: dict[str, str] = {}
+    in_group = False
+    for line in text.splitlines():
+        if line.startswith("["):
+            in_group = line.strip() == "[Trash Info]"
+        elif in_group and "=" in line:
+            key, value = line.split("=", 1)
+            fields.setdefault(key.strip(), value.strip())
+    try:
+        path = os.fsdecode(urllib.parse.unquote_to_bytes(fields["Path"]))
+        return path, fields["DeletionDate"]
+    except KeyError as missing:
+        raise ValueError(f"No {missing} in trash info") from None
+
+
+def tree_size(path: str) -> int:
+    """
+    Returns the total size of the files in the directory tree at `path`,
+    not following symlinks. Anything that can't be read is left out.
+    """
+    total = 0
+    pending = [path]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    return total
+
+
+def parse_directory_sizes(text: str) -> dict[str, DirectorySize]:
+    sizes = {}
+    for line in text.splitlines():
+        fields = line.split(" ", 2)
+        if len(fields) != 3:
+            continue
+        try:
+            size = DirectorySize(int(fields[0]), int(fields[1]))
+        except ValueError:
+            continue
+        sizes[os.fsdecode(urllib.parse.unquote_to_bytes(fields[2]))] = size
+    return sizes
+
+
+def _numbered_names(name: str):
+    yield name
+    stem, ext = os.path.splitext(name)
+    if not stem:
+        stem, ext = name, ""
+    n = 2
+    while True:
+        yield f"{stem}.{n}{ext}"
+        n += 1
+
+
+class TrashDirectory:
+    """
+    A trash directory, with its files and info subdirectories. If `topdir`
+    is given, the original paths recorded for trashed files are relative to
+    it, as the spec allows for trash directories at the top of a mount.
+    """
+
+    def __init__(self, path: str, topdir: Optional[str] = None):
+        self.path = path
+        self.files_dir = os.path.join(path, "files")
+        self.info_dir = os.path.join(path, "info")
+        self.sizes_path = os.path.join(path, DIRECTORY_SIZES_NAME)
+        self.topdir = topdir
+
+    def info_path(self, name: str) -> str:
+        return os.path.join(self.info_dir, name + TRASHINFO_SUFFIX)
+
+    def read_info(self, name: str) -> tuple[str, str]:
+        """
+        Returns the absolute original path and the deletion date of the
+        trashed file `name`.
+        """
+        with open(self.info_path(name), encoding="utf-8") as reader:
+            original, deleted = parse_trashinfo(reader.read())
+        if self.topdir is not None:
+            original = os.path.join(self.topdir, original)
+        return original, deleted
+
+    def ensure(self):
+        for dir_path in (self.path, self.files_dir, self.info_dir):
+            os.makedirs(dir_path, mode=0o700, exist_ok=True)
+
+    def contains(self, path: str) -> bool:
+        real_trash = os.path.realpath(self.path)
+        # Not resolving `path` itself, as a symlink is trashed, not its target
+        head, tail = os.path.split(os.path.abspath(path))
+        real_path = os.path.join(os.path.realpath(head), tail)
+        return os.path.commonpath((real_trash, real_path)) == real_trash
+
+    def trash(self, path: str) -> str:
+        """
+        Moves `path` into this trash directory, which must be on the same
+        device, and returns the name it was given there.
+        """
+        original = os.path.abspath(path)
+        if self.topdir is not None:
+            original = os.path.relpath(original, self.topdir)
+        info_text = trashinfo_text(original, time.time())
+
+        self.ensure()
+        name = self._reserve(os.path.basename(os.path.abspath(path)), info_text)
+        info_path = self.info_path(name)
+        trashed_path = os.path.join(self.files_dir, name)
+        try:
+            os.rename(path, trashed_path)
+        except BaseException:
+            os.unlink(info_path)
+            raise
+
+        if os.path.isdir(trashed_path) and not os.path.islink(trashed_path):
+            try:
+                size = DirectorySize(tree_size(trashed_path), self.info_mtime(name))
+                self.update_directory_sizes({name: size})
+            except OSError:
+                # Only a cache. It'll be filled in when it's next needed.
+                pass
+        return name
+
+    def info_mtime(self, name: str) -> int:
+        return int(os.stat(self.info_path(name)).st_mtime)
+
+    def read_directory_sizes(self) -> dict[str, DirectorySize]:
+        try:
+            with open(self.sizes_path, encoding="ascii") as reader:
+                return parse_directory_sizes(reader.read())
+        except (FileNotFoundError, UnicodeDecodeError):
+            return {}
+
+    def update_directory_sizes(self, changes: dict[str, Optional[DirectorySize]]):
+        """
+        Adds, replaces, or where the value is None, removes entries in the
+        directorysizes cache. Entries for items that have left the trash are
+        dropped at the same time.
+        """
+        sizes = self.read_directory_sizes()
+        for name, size in changes.items():
+            if size is None:
+                sizes.pop(name, None)
+            else:
+                sizes[name] = size
+        lines = [
+            f"{size.size} {size.info_mtime}"
+            f" {urllib.parse.quote(os.fsencode(name), safe='')}\n"
+            for name, size in sizes.items()
+            if os.path.exists(self.info_path(name))
+        ]
+
+        # Replaced atomically, as other programs may read it at any time
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".directorysizes")
+        try:
+            with open(fd, "w", encoding="ascii") as writer:
+                writer.writelines(lines)
+            os.replace(temp_path, self.sizes_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _reserve(self, name: str, info_text: str) -> str:
+        # Creating the info file exclusively is what claims a name, so that
+        # other programs trashing at the same time don't pick it too
+        for candidate in _numbered_names(name):
+            info_path = self.info_path(candidate)
+            try:
+                fd = os.open(info_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                continue
+            with open(fd, "w", encoding="utf-8") as writer:
+                writer.write(info_text)
+            if not os.path.lexists(os.path.join(self.files_dir, candidate)):
+                return candidate
+            # Left behind without its info file. Leave it alone.
+            os.unlink(info_path)
+        raise AssertionError("unreachable")
+
+    def restore(self, name: str, original: str):
+        """
+        Moves the trashed file `name` back to `original`, which mustn't
+        exist, and removes its info file.
+        """
+        if os.path.lexists(original):
+            raise FileExistsError(errno.EEXIST, "Already exists", original)
+        os.makedirs(os.path.dirname(original), exist_ok=True)
+        os.rename(os.path.join(self.files_dir, name), original)
+        os.unlink(self.info_path(name))
+
+    def purge(self, name: str):
+        """
+        Deletes the trashed file `name` for good. The info file goes last,
+        so that an interrupted purge leaves the entry listed.
+        """
+        path = os.path.join(self.files_dir, name)
+        try:
+            if stat.S_ISDIR(os.lstat(path).st_mode):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        os.unlink(self.info_path(name))
+
+
+class FreedesktopTrash:
+    """
+    Chooses a trash directory for each file: the home trash for files on
+    the same device as it, otherwise a trash directory at the top of the
+    file's mount.
+    """
+
+    def __init__(self, uid: Optional[int] = None, data_home: Optional[str] = None):
+        self.uid = os.getuid() if uid is None else uid
+        self.home_trash = TrashDirectory(
+            os.path.join(data_home or xdg_data_home(), "Trash")
+        )
+        self._home_device: Optional[int] = None
+        self._topdir_trashes: dict[str, TrashDirectory] = {}
+
+    def home_device(self) -> int:
+        if self._home_device is None:
+            self.home_trash.ensure()
+            self._home_device = os.stat(self.home_trash.path).st_dev
+        return self._home_device
+
+    def trash_directories(self) -> list[TrashDirectory]:
+        """
+        Returns the trash directories that exist for this user: the home
+        trash, and those at the top of each mount. None are created.
+        """
+        found = [self.home_trash] if os.path.isdir(self.home_trash.path) else []
+        for topdir in mount_points():
+            candidates = (
+                os.path.join(topdir, ".Trash", str(self.uid)),
+                os.path.join(topdir, f".Trash-{self.uid}"),
+            )
+            for trash_path in candidates:
+                try:
+                    trash_stat = os.lstat(trash_path)
+                except OSError:
+                    continue
+                if (
+                    stat.S_ISDIR(trash_stat.st_mode)
+                    and trash_path != self.home_trash.path
+                ):
+                    found.append(TrashDirectory(trash_path, topdir))
+        return found
+
+    def trash(self, path: str) -> str:
+        """
+        Moves `path` to the trash and returns the name it was given there.
+        """
+        device = os.lstat(path).st_dev
+        trash_dir = self.trash_directory_for(path, device)
+        if trash_dir.contains(path):
+            raise OSError(errno.EINVAL, "Can't move the trash to the trash", path)
+        return trash_dir.trash(path)
+
+    def trash_directory_for(self, path: str, device: int) -> TrashDirectory:
+        if device == self.home_device():
+            return self.home_trash
+
+        topdir = find_mount_point(os.path.dirname(os.path.abspath(path)))
+        trash_dir = self._topdir_trashes.get(topdir)
+        if trash_dir is None:
+            trash_dir = self._topdir_trash(topdir)
+            self._topdir_trashes[topdir] = trash_dir
+        if os.stat(trash_dir.path).st_dev != device:
+            raise OSError(errno.EXDEV, "No trash directory on the same device", path)
+        return trash_dir
+
+    def _topdir_trash(self, topdir: str) -> TrashDirectory:
+        # An administrator-created $topdir/.Trash is used if it's a real
+        # directory with the sticky bit set. Otherwise, each user gets their
+        # own $topdir/.Trash-$uid.
+        shared = os.path.join(topdir, ".Trash")
+        try:
+            shared_stat = os.lstat(shared)
+        except FileNotFoundError:
+            pass
+        else:
+            if stat.S_ISDIR(shared_stat.st_mode) and (
+                shared_stat.st_mode & stat.S_ISVTX
+            ):
+                trash_dir = TrashDirectory(os.path.join(shared, str(self.uid)), topdir)
+                try:
+                    trash_dir.ensure()
+                    return trash_dir
+                except OSError:
+                    pass
+
+        trash_dir = TrashDirectory(os.path.join(topdir, f".Trash-{self.uid}"), topdir)
+        trash_dir.ensure()
+        own_stat = os.lstat(trash_dir.path)
+        if not stat.S_ISDIR(own_stat.st_mode) or own_stat.st_uid != self.uid:
+            raise OSError(
+                errno.EPERM, "Trash directory isn't a private directory", trash_dir.path
+            )
+        return trash_dir
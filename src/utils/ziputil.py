@@ -0,0 +1,169 @@
+import bz2
+import copy
+import struct
+import zipfile
+import zlib
+from collections.abc import Iterable, Iterator
+
+# Offsets into the fixed part of a zip local file header
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_NAME_LENGTH_OFFSET = 26
+
+_ZIP64_EXTRA_ID = 0x0001
+_FLAG_ENCRYPTED = 0x01
+_FLAG_DATA_DESCRIPTOR = 0x08
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def strip_zip64_extra(extra: bytes) -> bytes:
+    """
+    Removes any zip64 extended information fields from a zip extra field, so
+    that a fresh one can be written for the member's new offset and sizes.
+    """
+    kept = []
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack_from("<HH", extra, offset)
+        end = offset + 4 + size
+        if header_id != _ZIP64_EXTRA_ID:
+            kept.append(extra[offset:end])
+        offset = end
+    return b"".join(kept)
+
+
+def is_encrypted(info: zipfile.ZipInfo) -> bool:
+    return bool(info.flag_bits & _FLAG_ENCRYPTED)
+
+
+def member_data_offset(source_fp, info: zipfile.ZipInfo) -> int:
+    """
+    Returns the file offset of a member's compressed data, which follows its
+    local header. The local header's name and extra fields can differ in
+    length from the central directory's, so it has to be read.
+    """
+    source_fp.seek(info.header_offset)
+    header = source_fp.read(_LOCAL_HEADER_SIZE)
+    if len(header) != _LOCAL_HEADER_SIZE or not header.startswith(b"PK\x03\x04"):
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename!r}")
+    name_length, extra_length = struct.unpack_from(
+        "<HH", header, _LOCAL_NAME_LENGTH_OFFSET
+    )
+    return info.header_offset + _LOCAL_HEADER_SIZE + name_length + extra_length
+
+
+def copy_member_raw(source_fp, info: zipfile.ZipInfo, dest: zipfile.ZipFile):
+    """
+    Appends a member to `dest` by copying its compressed bytes straight from
+    `source_fp`, the underlying file of the archive `info` came from, without
+    decompressing or recompressing it.
+
+    The zipfile module has no public API for writing already compressed data,
+    so this writes the local header itself and registers the member in
+    `dest`'s list so that close() writes it into the central directory.
+    """
+    data_offset = member_data_offset(source_fp, info)
+
+    new_info = copy.copy(info)
+    new_info.extra = strip_zip64_extra(info.extra)
+    # The sizes and CRC are already known, so they go in the local header
+    # rather than a trailing data descriptor
+    new_info.flag_bits &= ~_FLAG_DATA_DESCRIPTOR
+
+    dest_fp = dest.fp
+    assert dest_fp is not None
+    new_info.header_offset = dest_fp.tell()
+    dest_fp.write(new_info.FileHeader())
+
+    source_fp.seek(data_offset)
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source_fp.read(min(remaining, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename!r}")
+        dest_fp.write(chunk)
+        remaining -= len(chunk)
+
+    dest.filelist.append(new_info)
+    dest.NameToInfo[new_info.filename] = new_info
+    dest.start_dir = dest_fp.tell()
+
+
+def _inflate(chunks: Iterable[bytes], max_length: int) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk, max_length)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def _bunzip(chunks: Iterable[bytes], max_length: int) -> Iterator[bytes]:
+    decompressor = bz2.BZ2Decompressor()
+    for chunk in chunks:
+        yield decompressor.decompress(chunk, max_length)
+        while not decompressor.needs_input and not decompressor.eof:
+            yield decompressor.decompress(b"", max_length)
+
+
+_DECOMPRESSORS = {
+    zipfile.ZIP_DEFLATED: _inflate,
+    zipfile.ZIP_BZIP2: _bunzip,
+}
+
+
+def can_decompress(info: zipfile.ZipInfo) -> bool:
+    """
+    Returns True if iter_member_data() can read the member.
+    """
+    return not is_encrypted(info) and (
+        info.compress_type == zipfile.ZIP_STORED or info.compress_type in _DECOMPRESSORS
+    )
+
+
+def _iter_raw_member_data(source_fp, info: zipfile.ZipInfo, chunk_size: int):
+    source_fp.seek(member_data_offset(source_fp, info))
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source_fp.read(min(remaining, chunk_size))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename!r}")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def iter_member_data(
+    source_fp, info: zipfile.ZipInfo, chunk_size: int = COPY_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Yields the decompressed contents of a member in chunks of at most
+    `chunk_size` bytes, reading from `source_fp`, the underlying file of the
+    archive `info` came from. The size and CRC are checked against `info` as
+    the data is read, and zipfile.BadZipFile is raised if either doesn't
+    match.
+
+    Unlike ZipFile.open(), this doesn't share any state with a ZipFile, so
+    several threads can read members of the same archive at once, as long
+    as each has its own file object.
+    """
+    if not can_decompress(info):
+        raise NotImplementedError(f"Can't decompress {info.filename!r}")
+
+    chunks = _iter_raw_member_data(source_fp, info, chunk_size)
+    decompress = _DECOMPRESSORS.get(info.compress_type)
+    if decompress is not None:
+        chunks = decompress(chunks, chunk_size)
+
+    crc = 0
+    size = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        if size > info.file_size:
+            break
+        yield chunk
+
+    if size != info.file_size:
+        raise zipfile.BadZipFile(f"Bad size for {info.filename!r}")
+    if crc != info.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for {info.filename!r}")
@@ -0,0 +1,137 @@
+import io
+import os
+import stat
+import tarfile
+import zipfile
+
+import pytest
+
+from utils.extract import TarExtractor, ZipExtractor
+
+FORMATS = {
+    "gnu": tarfile.GNU_FORMAT,
+    "pax": tarfile.PAX_FORMAT,
+    "ustar": tarfile.USTAR_FORMAT,
+}
+
+# Over 100 characters, so it needs a long name record, a pax header or the
+# ustar prefix field depending on the format
+LONG_NAME = "deep/" + "d" * 60 + "/" + "f" * 60 + ".txt"
+
+MTIME = 1_700_000_000
+# 1960, which ustar can't represent
+OLD_MTIME = -315_619_200
+
+
+def add_file(archive, name, data, mtime=MTIME):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    info.mode = 0o644
+    archive.addfile(info, io.BytesIO(data))
+
+
+def add_link(archive, name, link_type, link_name):
+    info = tarfile.TarInfo(name)
+    info.type = link_type
+    info.linkname = link_name
+    info.mtime = MTIME
+    archive.addfile(info)
+
+
+def make_tar(members, format=tarfile.GNU_FORMAT):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w", format=format) as archive:
+        members(archive)
+    buffer.seek(0)
+    return buffer
+
+
+def extract(fileobj, out_dir):
+    warnings = []
+    stats = TarExtractor(out_dir, warnings.append).extract_fileobj(fileobj)
+    return stats, warnings
+
+
+@pytest.mark.parametrize("format_name", FORMATS)
+def test_matches_tarfile(tmp_path, format_name):
+    def members(archive):
+        info = tarfile.TarInfo("dir")
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = MTIME
+        archive.addfile(info)
+        add_file(archive, "dir/file.txt", b"hello\n")
+        add_file(archive, LONG_NAME, b"long\n")
+        add_link(archive, "dir/symlink", tarfile.SYMTYPE, "file.txt")
+        add_link(archive, "hardlink", tarfile.LNKTYPE, "dir/file.txt")
+        if format_name != "ustar":
+            add_file(archive, "old.txt", b"old\n", OLD_MTIME)
+
+    fileobj = make_tar(members, FORMATS[format_name])
+    stats, warnings = extract(fileobj, tmp_path)
+    assert warnings == []
+    assert stats.skipped == 0
+
+    fileobj.seek(0)
+    with tarfile.open(fileobj=fileobj) as expected:
+        for info in expected.getmembers():
+            path = tmp_path / info.name
+            if info.isdir():
+                assert path.is_dir()
+                assert os.stat(path).st_mtime == info.mtime
+            elif info.issym():
+                assert os.readlink(path) == info.linkname
+            elif info.islnk():
+                assert os.path.samefile(path, tmp_path / info.linkname)
+            else:
+                reader = expected.extractfile(info)
+                assert reader is not None
+                assert path.read_bytes() == reader.read()
+                assert os.stat(path).st_mtime == info.mtime
+
+
+def test_time_out_of_range_skips_member(tmp_path):
+    def members(archive):
+        add_file(archive, "far.txt", b"far\n", -(1 << 70))
+        add_file(archive, "after.txt", b"after\n")
+
+    stats, warnings = extract(make_tar(members), tmp_path)
+    assert stats.skipped == 1
+    assert len(warnings) == 1
+    assert (tmp_path / "after.txt").read_bytes() == b"after\n"
+
+
+def test_links_cannot_escape(tmp_path):
+    out_dir = tmp_path / "out"
+    outside = tmp_path / "outside.txt"
+    outside.write_bytes(b"original\n")
+
+    def members(archive):
+        info = tarfile.TarInfo("d")
+        info.type = tarfile.DIRTYPE
+        archive.addfile(info)
+        add_link(archive, "d/s", tarfile.SYMTYPE, "..")
+        add_link(archive, "d/t", tarfile.SYMTYPE, "s/..")
+        add_link(archive, "h", tarfile.LNKTYPE, "d/t/outside.txt")
+        add_file(archive, "h", b"overwritten\n")
+
+    out_dir.mkdir()
+    extract(make_tar(members), out_dir)
+    assert outside.read_bytes() == b"original\n"
+
+
+def test_zip_dir_without_unix_mode(tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        info = zipfile.ZipInfo("dosdir/")
+        info.create_system = 0
+        archive.writestr(info, b"")
+        archive.writestr("implicit/file.txt", b"data")
+    archive_path = tmp_path / "test.zip"
+    archive_path.write_bytes(buffer.getvalue())
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    ZipExtractor(out_dir, pytest.fail).extract_file(archive_path)
+    assert stat.S_IMODE(os.stat(out_dir / "dosdir").st_mode) == 0o755
@@ -0,0 +1,39 @@
+import os
+import sqlite3
+
+from utils.optdb import OptimizedDB, OUTCOME_OPTIMIZED, record_file
+
+# Not valid UTF-8, so it decodes with a surrogate escape
+UNDECODABLE_NAME = os.fsdecode(b"x\xe9.jpg")
+
+
+def test_undecodable_path(tmp_path):
+    path = tmp_path / UNDECODABLE_NAME
+    path.write_bytes(b"data")
+
+    with OptimizedDB(tmp_path / "db.sqlite") as db:
+        assert not db.is_unchanged(path)
+        db.put(record_file(path, OUTCOME_OPTIMIZED, ["optimize"]))
+        assert db.is_unchanged(path, ["optimize"])
+        record = db.get(path)
+        assert record is not None
+        assert record.path == os.path.realpath(path)
+
+
+def test_text_paths_are_migrated(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"data")
+    record = record_file(path, OUTCOME_OPTIMIZED)
+
+    db_path = tmp_path / "db.sqlite"
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute(
+            "CREATE TABLE files (path TEXT PRIMARY KEY, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL, outcome TEXT NOT NULL)"
+        )
+        conn.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?)", record[:5])
+    conn.close()
+
+    with OptimizedDB(db_path) as db:
+        assert db.get(path) == record
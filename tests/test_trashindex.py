@@ -0,0 +1,24 @@
+import os
+
+from utils.trashindex import TrashIndex
+from utils.xdgtrash import TrashDirectory
+
+# Not valid UTF-8, so it decodes with a surrogate escape
+UNDECODABLE_NAME = os.fsdecode(b"caf\xe9.txt")
+
+
+def test_undecodable_names(tmp_path):
+    trash_dir = TrashDirectory(os.fspath(tmp_path / "Trash"))
+    path = tmp_path / UNDECODABLE_NAME
+    path.touch()
+    name = trash_dir.trash(os.fspath(path))
+
+    with TrashIndex(tmp_path / "index.sqlite") as index:
+        index.sync([trash_dir])
+        (entry,) = index.all()
+        assert entry.name == name
+        assert entry.original_path == os.fspath(path)
+        assert index.matching("caf*") == [entry]
+
+        index.remove(entry)
+        assert index.all() == []